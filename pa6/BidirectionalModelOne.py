@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+#Joint training of both directions of IBM Model One
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+import itertools as it
+import collections
+import math
+import time
+import array
+from ModelOne import ModelOne, peakMemoryMB, formatStats, CANDIDATE_COUNT
+from Corpus import PrefixedLines
+from Tokenizer import tokenizeBatch
+
+NULL = "<NULL>"
+
+class BidirectionalModelOne:
+	"""
+	Trains ModelOne(foreign_file, native_file) and ModelOne(native_file, foreign_file) together.
+
+	The bitext is tokenized once, and both directions share one co-occurrence index:
+		index[e][f] = id of the pair, into the float arrays tForward (t(f|e)), tReverse (t(e|f)),
+		countForward and countReverse (their expected counts in the current iteration)
+	NULL is one more row and column of the index: the pairs (NULL, f) only have a t(f|NULL) and the
+	pairs (e, NULL) only a t(e|NULL). Every iteration walks each sentence pair once and collects the
+	expected counts of both directions from the same lookups. The result is the same as two separate
+	ModelOne runs:
+		model = BidirectionalModelOne("stuff.es", "stuff.en")
+		model.forward   #like ModelOne("stuff.es", "stuff.en"), indexed [english][spanish]
+		model.reverse   #like ModelOne("stuff.en", "stuff.es"), indexed [spanish][english]
+	"""
+	def __init__(self, foreign_file, native_file, iterations=5, Verbose=False):
+		with open(foreign_file) as f:
+			self.foreign_lines = list(tokenizeBatch(f))
+		with open(native_file) as n:
+			self.native_lines = list(tokenizeBatch(n))
+		self.index = None
+		self.tForward = self.tReverse = None
+		self.countForward = self.countReverse = None
+		self.forward = ModelOne()
+		self.reverse = ModelOne()
+		self.forward.foreign_lines = self.foreign_lines
+		self.forward.native_lines = PrefixedLines(self.native_lines, NULL)
+		self.reverse.foreign_lines = self.native_lines
+		self.reverse.native_lines = PrefixedLines(self.foreign_lines, NULL)
+		self.train(iterations, Verbose)
+
+	def train(self, iterations, Verbose=False):
+		"""
+		Trains both directions from the co-occurrence counts and stores them in forward and reverse.
+		The index and the arrays are released as the models are filled.
+		"""
+		for iteration in xrange(iterations):
+			start = time.time()
+			if self.index is None:
+				self._initialize()
+				forwardStats, reverseStats = (None, 0, None), (None, 0, None)
+			else:
+				forwardStats, reverseStats = self._iterate()
+			for model, (logLikelihood, words, maxChange) in ((self.forward, forwardStats), (self.reverse, reverseStats)):
+				model.iterationsDone += 1
+				model.trainingLog.append({
+					"iteration": model.iterationsDone,
+					"logLikelihood": logLikelihood,
+					"perplexity": math.exp(-logLikelihood / words) if words else None,
+					"maxChange": maxChange,
+					"seconds": time.time() - start,
+					"peakMemoryMB": peakMemoryMB(),
+				})
+			if Verbose:
+				print "Forward  " + formatStats(self.forward.trainingLog[-1])
+				print "Reverse  " + formatStats(self.reverse.trainingLog[-1])
+
+		if Verbose:
+			print "Sorting and reversing dictionaries..."
+		index, tForward, tReverse = self.index, self.tForward, self.tReverse
+		self.index = self.tForward = self.tReverse = self.countForward = self.countReverse = None
+		self.forward._storeEntries((native_w, foreign_w, tForward[i]) for native_w, row in index.iteritems() for foreign_w, i in row.iteritems() if foreign_w != NULL)
+		#the rows are dropped from the index once the reverse model has them
+		self.reverse._storeEntries((foreign_w, native_w, tReverse[i]) for native_w, row in _drain(index) for foreign_w, i in row.iteritems() if native_w != NULL)
+
+	def _pairId(self, row, word):
+		"""
+		Returns the id of the pair (row, word) of the index, adding it if it is new
+		"""
+		i = row.get(word)
+		if i is None:
+			i = row[word] = len(self.tForward)
+			for values in (self.tForward, self.tReverse, self.countForward, self.countReverse):
+				values.append(0.0)
+		return i
+
+	def _initialize(self):
+		"""
+		Co-occurrence counts of both directions, normalized per conditioning word / first iteration
+		"""
+		self.index = {NULL: {}}
+		self.tForward, self.tReverse = array.array("d"), array.array("d")
+		self.countForward, self.countReverse = array.array("d"), array.array("d")
+		index, pairId = self.index, self._pairId
+		countForward, countReverse = self.countForward, self.countReverse
+		for foreign_s, native_s in it.izip(self.foreign_lines, self.native_lines):
+			nullRow = index[NULL]
+			for foreign_w in foreign_s:
+				countForward[pairId(nullRow, foreign_w)] += 1.0
+			for native_w in native_s:
+				row = index.get(native_w)
+				if row is None:
+					row = index[native_w] = {}
+				countReverse[pairId(row, NULL)] += 1.0
+				#a word opposite an empty line only aligns to NULL, it gets no pairs of its own
+				for foreign_w in foreign_s:
+					i = pairId(row, foreign_w)
+					countForward[i] += 1.0
+					countReverse[i] += 1.0
+		self._maximize()
+
+	def _iterate(self):
+		"""
+		One E-step and M-step for both directions in a single pass over the bitext
+		"""
+		index = self.index
+		nullRow = index[NULL]
+		tForward, tReverse = self.tForward, self.tReverse
+		countForward, countReverse = self.countForward, self.countReverse
+		forwardLikelihood = reverseLikelihood = 0.0
+		forwardWords = reverseWords = 0
+		for foreign_s, native_s in it.izip(self.foreign_lines, self.native_lines):
+			rows = [index[native_w] for native_w in native_s]
+			ids = [[row[foreign_w] for foreign_w in foreign_s] for row in rows]
+			forwardNull = [nullRow[foreign_w] for foreign_w in foreign_s]
+			reverseNull = [row[NULL] for row in rows]
+			forwardTotal = collections.defaultdict(float)
+			reverseTotal = collections.defaultdict(float)
+			for j, foreign_w in enumerate(foreign_s):
+				t_sum = tForward[forwardNull[j]]
+				for row in ids:
+					t_sum += tForward[row[j]]
+				forwardTotal[foreign_w] += t_sum
+				forwardLikelihood += math.log(t_sum)
+			for native_w, row, null in it.izip(native_s, ids, reverseNull):
+				t_sum = tReverse[null]
+				for i in row:
+					t_sum += tReverse[i]
+				reverseTotal[native_w] += t_sum
+				reverseLikelihood += math.log(t_sum)
+			if foreign_s:
+				forwardLikelihood -= len(foreign_s) * math.log(len(native_s) + 1)
+				forwardWords += len(foreign_s)
+			if native_s:
+				reverseLikelihood -= len(native_s) * math.log(len(foreign_s) + 1)
+				reverseWords += len(native_s)
+			forwardInverse = [1.0 / forwardTotal[foreign_w] for foreign_w in foreign_s]
+			for native_w, row in it.izip(native_s, ids):
+				reverseInverse = 1.0 / reverseTotal[native_w]
+				for i, inverse in it.izip(row, forwardInverse):
+					countForward[i] += tForward[i] * inverse
+					countReverse[i] += tReverse[i] * reverseInverse
+			for i, inverse in it.izip(forwardNull, forwardInverse):
+				countForward[i] += tForward[i] * inverse
+			for native_w, i in it.izip(native_s, reverseNull):
+				countReverse[i] += tReverse[i] / reverseTotal[native_w]
+		forwardChange, reverseChange = self._maximize()
+		return (forwardLikelihood, forwardWords, forwardChange), (reverseLikelihood, reverseWords, reverseChange)
+
+	def _maximize(self):
+		"""
+		Turns the expected counts into the next t(f|e) (summing to one over f for every e and NULL)
+		and t(e|f) (summing to one over e for every f and NULL), and resets the counts.
+		Returns the largest change of each direction.
+		"""
+		tForward, tReverse = self.tForward, self.tReverse
+		countForward, countReverse = self.countForward, self.countReverse
+		forwardSum = collections.defaultdict(float)
+		reverseSum = collections.defaultdict(float)
+		for native_w, row in self.index.iteritems():
+			for foreign_w, i in row.iteritems():
+				forwardSum[native_w] += countForward[i]
+				reverseSum[foreign_w] += countReverse[i]
+		forwardChange = reverseChange = 0.0
+		for native_w, row in self.index.iteritems():
+			#(e, NULL) has no forward count and (NULL, f) no reverse count, their t stays 0
+			forwardInverse = 1.0 / forwardSum[native_w] if forwardSum[native_w] else 0.0
+			for foreign_w, i in row.iteritems():
+				t_forward = countForward[i] * forwardInverse
+				t_reverse = countReverse[i] / reverseSum[foreign_w] if reverseSum[foreign_w] else 0.0
+				forwardChange = max(forwardChange, abs(t_forward - tForward[i]))
+				reverseChange = max(reverseChange, abs(t_reverse - tReverse[i]))
+				tForward[i] = t_forward
+				tReverse[i] = t_reverse
+		self.countForward = array.array("d", [0.0]) * len(tForward)
+		self.countReverse = array.array("d", [0.0]) * len(tReverse)
+		return forwardChange, reverseChange
+
+	def saveToFile(self, forwardName, reverseName, includeCorpus=False, candidateCount=CANDIDATE_COUNT):
+		"""
+		Saves both directions, e.g. as the spanish-english.model and english-spanish.model of PhraseTable
+		"""
+		self.forward.saveToFile(forwardName, includeCorpus, candidateCount)
+		self.reverse.saveToFile(reverseName, includeCorpus, candidateCount)
+
+def _drain(table):
+	"""
+	Yields the items of table, removing each one from it first
+	"""
+	while table:
+		yield table.popitem()
+
+######FOR TESTING PURPOSES ONLY########
+def main():
+	spanish_file = "../pa6/es-en/train/europarl-v7.es-en.es"
+	english_file = "../pa6/es-en/train/europarl-v7.es-en.en"
+
+	model = BidirectionalModelOne(spanish_file, english_file, Verbose=True)
+	#PhraseTable reads the model indexed [spanish][english] from english-spanish.model
+	model.saveToFile("spanish-english.model", "english-spanish.model")
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#Memory-mapped binary container used by the model and corpus files
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+import mmap
+import struct
+import bisect
+
+HEADER = struct.Struct("<8sII")           # magic, version, number of sections
+SECTION = struct.Struct("<24s1sxxxxxxxQQ")  # name, struct type code, offset, number of items
+ALIGNMENT = 8
+CHUNK = 1 << 16
+
+def writeFile(fileName, magic, version, sections):
+	"""
+	Writes a binary file made of named typed arrays.
+	sections is a list of (name, typecode, values) where typecode is a struct format character
+	("I", "Q", "f", "d", "B", ...) and values is any sequence of numbers. The special typecode "s"
+	stores a byte string as is.
+	"""
+	offset = HEADER.size + SECTION.size * len(sections)
+	layout = []
+	for name, typecode, values in sections:
+		if len(name) > 24:
+			raise ValueError("Section name too long: " + name)
+		offset += -offset % ALIGNMENT
+		layout.append((name, typecode, offset, len(values)))
+		offset += len(values) * struct.calcsize("<" + typecode)
+	with open(fileName, "wb") as f:
+		f.write(HEADER.pack(magic, version, len(sections)))
+		for name, typecode, offset, length in layout:
+			f.write(SECTION.pack(name, typecode, offset, length))
+		for (name, typecode, values), (_, _, offset, length) in zip(sections, layout):
+			f.write("\0" * (offset - f.tell()))
+			if typecode == "s":
+				f.write(values)
+				continue
+			for start in xrange(0, length, CHUNK):
+				chunk = values[start:start + CHUNK]
+				f.write(struct.pack("<%d%s" % (len(chunk), typecode), *chunk))
+
+def stringSections(name, strings):
+	"""
+	Returns the sections storing a sorted list of byte strings, to be read back by StringTable
+	"""
+	offsets = [0]
+	for s in strings:
+		offsets.append(offsets[-1] + len(s))
+	return [(name + ".off", "Q", offsets), (name + ".str", "s", "".join(strings))]
+
+class BinaryFile:
+	"""
+	Read-only view of a file written by writeFile. Nothing is read until a section is accessed,
+	and sections are returned as MappedArrays over the shared mmap.
+	"""
+	def __init__(self, fileName, magic):
+		with open(fileName, "rb") as f:
+			self.buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		fileMagic, self.version, count = HEADER.unpack_from(self.buf, 0)
+		if fileMagic != magic:
+			raise ValueError(fileName + " is not a " + magic.strip() + " file")
+		self.sections = {}
+		for i in xrange(count):
+			name, typecode, offset, length = SECTION.unpack_from(self.buf, HEADER.size + i * SECTION.size)
+			self.sections[name.rstrip("\0")] = (typecode, offset, length)
+
+	def __contains__(self, name):
+		return name in self.sections
+
+	def section(self, name):
+		typecode, offset, length = self.sections[name]
+		if typecode == "s":
+			return buffer(self.buf, offset, length)
+		return MappedArray(self.buf, offset, typecode, length)
+
+	def strings(self, name):
+		return StringTable(self.section(name + ".off"), self.section(name + ".str"))
+
+	@staticmethod
+	def isBinary(fileName, magic):
+		with open(fileName, "rb") as f:
+			return f.read(len(magic)) == magic
+
+class MappedArray:
+	"""
+	Sequence of numbers stored little-endian in a buffer. Items are unpacked on access.
+	"""
+	def __init__(self, buf, offset, typecode, length):
+		self.buf = buf
+		self.offset = offset
+		self.item = struct.Struct("<" + typecode)
+		self.typecode = typecode
+		self.length = length
+
+	def __len__(self):
+		return self.length
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			start, stop, step = index.indices(self.length)
+			if step != 1:
+				return [self[i] for i in xrange(start, stop, step)]
+			count = max(stop - start, 0)
+			return list(struct.unpack_from("<%d%s" % (count, self.typecode), self.buf, self.offset + start * self.item.size))
+		if index < 0:
+			index += self.length
+		if not 0 <= index < self.length:
+			raise IndexError("MappedArray index out of range")
+		return self.item.unpack_from(self.buf, self.offset + index * self.item.size)[0]
+
+	def __iter__(self):
+		for start in xrange(0, self.length, CHUNK):
+			for value in self[start:start + CHUNK]:
+				yield value
+
+	def find(self, value):
+		"""
+		Returns the index of value in a sorted array, or -1 if it is not there. Same as a bisect
+		over the array, without going through __getitem__ for every probe.
+		"""
+		unpack, offset, size = self.item.unpack_from, self.offset, self.item.size
+		buf = self.buf
+		lo, hi = 0, self.length
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if unpack(buf, offset + mid * size)[0] < value:
+				lo = mid + 1
+			else:
+				hi = mid
+		if lo < self.length and unpack(buf, offset + lo * size)[0] == value:
+			return lo
+		return -1
+
+class StringTable:
+	"""
+	Sorted list of byte strings. index() is a binary search over the mapped file, so the vocabulary
+	never has to be loaded into a dictionary.
+	"""
+	def __init__(self, offsets, blob):
+		self.offsets = offsets
+		self.blob = blob
+		self.length = len(offsets) - 1
+		self.pair = struct.Struct("<2" + offsets.typecode)
+
+	def __len__(self):
+		return self.length
+
+	def __getitem__(self, index):
+		if index < 0:
+			index += self.length
+		if not 0 <= index < self.length:
+			raise IndexError("StringTable index out of range")
+		start, end = self.pair.unpack_from(self.offsets.buf, self.offsets.offset + index * self.offsets.item.size)
+		return self.blob[start:end]
+
+	def __iter__(self):
+		for i in xrange(len(self)):
+			yield self[i]
+
+	def index(self, word):
+		"""
+		Returns the id of word, or -1 if it is not in the table
+		"""
+		offsets, blob, unpack = self.offsets, self.blob, self.pair.unpack_from
+		buf, base, size = offsets.buf, offsets.offset, offsets.item.size
+		lo, hi = 0, self.length
+		while lo < hi:
+			mid = (lo + hi) // 2
+			start, end = unpack(buf, base + mid * size)
+			if blob[start:end] < word:
+				lo = mid + 1
+			else:
+				hi = mid
+		if lo < self.length:
+			start, end = unpack(buf, base + lo * size)
+			if blob[start:end] == word:
+				return lo
+		return -1
+
+class SortedWords:
+	"""
+	In-memory sorted list of strings with the same interface as StringTable
+	"""
+	def __init__(self, words):
+		self.words = sorted(set(words))
+
+	def __len__(self):
+		return len(self.words)
+
+	def __getitem__(self, index):
+		return self.words[index]
+
+	def __iter__(self):
+		return iter(self.words)
+
+	def index(self, word):
+		i = bisect.bisect_left(self.words, word)
+		if i < len(self.words) and self.words[i] == word:
+			return i
+		return -1
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+#Top-k translation candidates for every foreign word of a ModelOne
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+NO_CANDIDATES = ()
+
+class CandidateIndex:
+	"""
+	Maps every foreign word to a tuple of its k best (native_word, log-probability) pairs,
+	best first. The tuples are built once, so a lookup neither allocates nor touches the model,
+	and unknown words get the shared empty tuple.
+	"""
+	def __init__(self, k, rows=None):
+		self.k = k
+		self.rows = rows if rows is not None else {}
+
+	@staticmethod
+	def fromTable(reverseMap, k=50):
+		"""
+		Builds the index from a reverseMap indexed [foreign_word][native_word]
+		"""
+		index = CandidateIndex(k)
+		for foreign_w, native_dict in reverseMap.iteritems():
+			best = sorted(native_dict.iteritems(), key=lambda item: item[1], reverse=True)[:k]
+			if best:
+				index.rows[foreign_w] = tuple(best)
+		return index
+
+	def __getitem__(self, foreign_w):
+		return self.rows.get(foreign_w, NO_CANDIDATES)
+
+	def __contains__(self, foreign_w):
+		return foreign_w in self.rows
+
+	def __len__(self):
+		return len(self.rows)
+
+	def iteritems(self):
+		return self.rows.iteritems()
+
+class MappedCandidateIndex(CandidateIndex):
+	"""
+	CandidateIndex read from a model file. Rows are decoded from the mapped arrays the first
+	time a word is looked up and reused afterwards.
+	"""
+	def __init__(self, k, foreign_vocab, native_vocab, offsets, natives, values):
+		CandidateIndex.__init__(self, k)
+		self.foreign_vocab = foreign_vocab
+		self.native_vocab = native_vocab
+		self.offsets = offsets
+		self.natives = natives
+		self.values = values
+
+	def __getitem__(self, foreign_w):
+		row = self.rows.get(foreign_w)
+		if row is None:
+			row = self._decode(foreign_w)
+			if row:
+				self.rows[foreign_w] = row
+		return row
+
+	def __contains__(self, foreign_w):
+		return len(self[foreign_w]) > 0
+
+	def __len__(self):
+		return len(self.foreign_vocab)
+
+	def iteritems(self):
+		for foreign_w in self.foreign_vocab:
+			row = self[foreign_w]
+			if row:
+				yield foreign_w, row
+
+	def _decode(self, foreign_w):
+		foreign_id = self.foreign_vocab.index(foreign_w)
+		if foreign_id < 0:
+			return NO_CANDIDATES
+		start, end = self.offsets[foreign_id:foreign_id + 2]
+		if start == end:
+			return NO_CANDIDATES
+		native_vocab = self.native_vocab
+		return tuple((native_vocab[native_id], value) for native_id, value in zip(self.natives[start:end], self.values[start:end]))
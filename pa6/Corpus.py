@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#Disk-backed tokenized corpus
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+import os
+import mmap
+import struct
+import hashlib
+import tempfile
+import collections
+from BinaryFile import BinaryFile, MappedArray, writeFile, stringSections, CHUNK
+
+MAGIC = "MTCORPUS"
+VERSION = 2
+
+def corpusPath(corpusDir, fileName, prefix=None):
+	"""
+	Returns where the corpus of fileName is cached inside corpusDir. The name includes a hash of the
+	absolute path, so files with the same name in different directories get different corpora.
+	"""
+	digest = hashlib.md5(os.path.abspath(fileName)).hexdigest()[:16]
+	name = os.path.basename(fileName) + "." + digest + (".prefixed" if prefix else "") + ".corpus"
+	return os.path.join(corpusDir, name)
+
+def openCorpus(fileName, corpusDir, tokenize, prefix=None):
+	"""
+	Returns the Corpus of fileName, building it first unless an up to date one is already in corpusDir
+	"""
+	path = corpusPath(corpusDir, fileName, prefix)
+	if not isCurrent(path, fileName):
+		if not os.path.isdir(corpusDir):
+			os.makedirs(corpusDir)
+		buildCorpus(fileName, path, tokenize, prefix)
+	return Corpus(path)
+
+def sourceInfo(fileName):
+	"""
+	Returns (absolute path, size, modification time) of fileName, as stored in the corpora built from it
+	"""
+	info = os.stat(fileName)
+	return os.path.abspath(fileName), info.st_size, info.st_mtime
+
+def isCurrent(corpusFile, fileName):
+	"""
+	Whether corpusFile exists and was built from fileName as it is now: same path, size and modification time
+	"""
+	if not os.path.exists(corpusFile):
+		return False
+	try:
+		f = BinaryFile(corpusFile, MAGIC)
+	except (ValueError, struct.error, EnvironmentError):
+		return False
+	try:
+		if f.version != VERSION or "src" not in f or "src.info" not in f:
+			return False
+		return (str(f.section("src")), ) + tuple(f.section("src.info")) == sourceInfo(fileName)
+	finally:
+		#the corpus file is rewritten in place when it is stale
+		f.buf.close()
+
+def buildCorpus(fileName, corpusFile, tokenize, prefix=None):
+	"""
+	Tokenizes fileName in a single streaming pass and writes corpusFile: a sorted vocabulary,
+	an int32 token id array, per-sentence offsets and the path, size and modification time of fileName. Only the vocabulary is kept in memory;
+	token ids go to a temporary file and are renumbered into sorted vocabulary order when copied.
+	prefix is a list of tokens put in front of every sentence (e.g. ["<NULL>"]).
+	"""
+	ids = collections.defaultdict(lambda: len(ids))
+	offsets = [0]
+	path, size, mtime = sourceInfo(fileName)
+	with tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(corpusFile))) as tmp:
+		with open(fileName) as f:
+			for line in f:
+				words = (prefix or []) + tokenize(line)
+				tmp.write(struct.pack("<%di" % len(words), *[ids[w] for w in words]))
+				offsets.append(offsets[-1] + len(words))
+		tmp.flush()
+		vocab = sorted(ids.iterkeys())
+		remap = [0] * len(vocab)
+		for new_id, word in enumerate(vocab):
+			remap[ids[word]] = new_id
+		buf = mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ) if offsets[-1] else ""
+		tokens = _Remapped(MappedArray(buf, 0, "i", offsets[-1]), remap)
+		writeFile(corpusFile, MAGIC, VERSION, stringSections("vocab", vocab) + [("off", "Q", offsets), ("tok", "i", tokens),
+			("src", "s", path), ("src.info", "d", [size, mtime])])
+
+class _Remapped:
+	"""
+	Sliceable view translating the token ids of a MappedArray through remap
+	"""
+	def __init__(self, tokens, remap):
+		self.tokens = tokens
+		self.remap = remap
+
+	def __len__(self):
+		return len(self.tokens)
+
+	def __getitem__(self, index):
+		remap = self.remap
+		return [remap[token] for token in self.tokens[index]]
+
+class MappedLines:
+	"""
+	Read-only list of tokenized sentences stored as token ids in a mapped file.
+	Sentences are decoded to lists of words only when they are accessed.
+	"""
+	def __init__(self, vocab, offsets, tokens):
+		self.vocab = vocab
+		self.offsets = offsets
+		self.tokens = tokens
+		self.words = None
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, index):
+		if index < 0:
+			index += len(self)
+		words = self._words()
+		return [words[token] for token in self.ids(index)]
+
+	def ids(self, index):
+		"""
+		Returns sentence index as a list of token ids
+		"""
+		start, end = self.offsets[index:index + 2]
+		return self.tokens[start:end]
+
+	def _words(self):
+		#the vocabulary is small next to the corpus, so it is decoded once
+		if self.words is None:
+			self.words = list(self.vocab)
+		return self.words
+
+	def __iter__(self):
+		words = self._words()
+		for sentence in self.iterids():
+			yield [words[token] for token in sentence]
+
+	def iterids(self):
+		"""
+		Iterates over the sentences as lists of token ids, reading the file a chunk at a time
+		"""
+		n = len(self)
+		for first in xrange(0, n, CHUNK):
+			offsets = self.offsets[first:min(first + CHUNK, n) + 1]
+			tokens = self.tokens[offsets[0]:offsets[-1]]
+			base = offsets[0]
+			for start, end in zip(offsets, offsets[1:]):
+				yield tokens[start - base:end - base]
+
+class Corpus(MappedLines):
+	"""
+	A corpus file written by buildCorpus, usable anywhere a list of tokenized sentences is expected
+	"""
+	def __init__(self, fileName):
+		f = BinaryFile(fileName, MAGIC)
+		MappedLines.__init__(self, f.strings("vocab"), f.section("off"), f.section("tok"))
+
+class ConcatLines:
+	"""
+	Read-only concatenation of several lists of sentences (lists or Corpus objects)
+	"""
+	def __init__(self, *parts):
+		self.parts = parts
+
+	def __len__(self):
+		return sum(len(part) for part in self.parts)
+
+	def __getitem__(self, index):
+		if index < 0:
+			index += len(self)
+		for part in self.parts:
+			if index < len(part):
+				return part[index]
+			index -= len(part)
+		raise IndexError("ConcatLines index out of range")
+
+	def __iter__(self):
+		for part in self.parts:
+			for sentence in part:
+				yield sentence
+
+class PrefixedLines:
+	"""
+	Read-only view of a list of sentences with the same token put in front of every sentence
+	"""
+	def __init__(self, lines, prefix):
+		self.lines = lines
+		self.prefix = [prefix]
+
+	def __len__(self):
+		return len(self.lines)
+
+	def __getitem__(self, index):
+		return self.prefix + self.lines[index]
+
+	def __iter__(self):
+		for sentence in self.lines:
+			yield self.prefix + sentence
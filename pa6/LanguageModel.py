@@ -3,10 +3,18 @@
 #Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
 
 from math import log
+import sys
 import collections
+import getopt
+from NgramStore import NgramStore, UNKNOWN
+from NgramReader import readCounts
+
+#stupid backoff weights, one and two orders down
+LOG_BACKOFF = log(0.4)
+LOG_BACKOFF2 = log(0.4*0.4)
 
 class LanguageModel:
-	def __init__(self, unigram_file="../pa6/ngrams/1.txt", bigram_file="../pa6/ngrams/2.txt", trigram_file="../pa6/ngrams/3.txt"):
+	def __init__(self, unigram_file="../pa6/ngrams/1.txt", bigram_file="../pa6/ngrams/2.txt", trigram_file="../pa6/ngrams/3.txt", binary_file=None, contextCacheSize=10000, cutoffs=None, vocabulary=None, levels=None, store=None, workers=None):
 		'''
 			unigram_file: the path to the text file that contains the unigram unigramCounts
 							its expected format is: 
@@ -20,80 +28,249 @@ class LanguageModel:
 
 			The language trains itself upon initialization and can score any sentence afterwards.
 			It uses a stupid backoff with Laplace-smoothed unigrams.
+			Counts live in a read-only NgramStore, so scoring does not grow the model.
+
+			binary_file: a language model compiled once with compile() (or by running this file);
+							when given, it is memory-mapped instead of training from the text files:
+							LanguageModel.compile("lm.bin")
+							langModel = LanguageModel(binary_file="lm.bin")
+
+			contextCacheSize: how many resolved contexts score_batch keeps (least recently used go first)
+
+			To make the model smaller when training from the text files:
+			cutoffs: (unigram, bigram, trigram) minimum counts, rarer n-grams are dropped
+			vocabulary: a set of words (e.g. PhraseTable.native_words()), n-grams using others are dropped
+			levels: store log-probabilities as one-byte codes into a codebook of this many values
+			workers: processes used to read the n-gram files (which may be gzip, bzip2 or xz compressed),
+							default is one per core
+
+			store: an NgramStore to use as is
 		'''
-		self.unigramCounts = collections.defaultdict(lambda: 1)
-		self.bigramCounts = collections.defaultdict(lambda: collections.defaultdict(lambda: 0))
-		self.bigramsWithStartingUnigram = collections.defaultdict(lambda: 1)
-		self.trigramCounts = collections.defaultdict(lambda: collections.defaultdict(lambda: 0))
-		self.trigramsWithStartingBigram = collections.defaultdict(lambda: 1)
+		self.store = None
 		self.totalUnigrams = 0
-		self.train(unigram_file, bigram_file, trigram_file)
+		self.contextCache = collections.OrderedDict()
+		self.contextCacheSize = contextCacheSize
+		if store is not None:
+			self.store = store
+		elif binary_file:
+			self.store = NgramStore.load(binary_file)
+		else:
+			self.train(unigram_file, bigram_file, trigram_file, cutoffs, vocabulary, levels, workers)
+		self.totalUnigrams = self.store.totalUnigrams
+
+	#state of the empty sentence for score_next: (second to last word id, last word id, length up to 3)
+	START = (UNKNOWN, UNKNOWN, 0)
+
+	@staticmethod
+	def compile(binary_file, unigram_file="../pa6/ngrams/1.txt", bigram_file="../pa6/ngrams/2.txt", trigram_file="../pa6/ngrams/3.txt", cutoffs=None, vocabulary=None, levels=None, workers=None):
+		'''
+			Trains on the text n-gram files and writes the result to binary_file
+		'''
+		LanguageModel(unigram_file, bigram_file, trigram_file, cutoffs=cutoffs, vocabulary=vocabulary, levels=levels, workers=workers).store.save(binary_file)
 
 	def unigramScore(self, word):
-		return log(self.unigramCounts[word]) - log(self.totalUnigrams) - log(0.16)
-
-	def train(self, unigram_file, bigram_file, trigram_file):
-		with open(unigram_file) as u:
-			for line in u:
-				token, count = line.split()
-				self.unigramCounts[token] += int(count)
-				self.totalUnigrams += int(count)
-		with open(bigram_file) as b:
-			for line in b:
-				count, token1, token2 = line.split()
-				self.bigramCounts[token1][token2] += int(count)
-		with open(trigram_file) as t:
-			for line in t:
-				count, token1, token2, token3 = line.split()
-				self.trigramCounts[token1 + " " + token2][token3] += int(count)
-		self.totalUnigrams += len(self.unigramCounts)
-		for startWord, bigrams in self.bigramCounts.iteritems():
-			self.bigramsWithStartingUnigram[startWord] = sum([val for key, val in bigrams.iteritems()])
-		for beginning, trigrams in self.trigramCounts.iteritems():
-			self.trigramsWithStartingBigram[beginning] = sum([val for key, val in trigrams.iteritems()])
-
-				
+		return self.store.unigramLogProb(self.store.wordId(word)) - log(0.16)
 
+	def train(self, unigram_file, bigram_file, trigram_file, cutoffs=None, vocabulary=None, levels=None, workers=None):
+		self.store = NgramStore.fromFiles(unigram_file, bigram_file, trigram_file, cutoffs, vocabulary, workers)
+		if levels:
+			self.store = self.store.quantize(levels)
+		self.totalUnigrams = self.store.totalUnigrams
+		self.contextCache.clear()
 
 	def score(self, sentence):
 		'''
 			score takes a sentence(a list of words), and scores it using the language model.
 		'''
+		store = self.store
 		score = 0.0
-		lastToken = ""
-		secondToLastToken = ""
+		lastToken = None
+		secondToLastToken = None
+		sentence = [store.wordId(word) for word in sentence]
 		if len(sentence) == 1:
-			return log(self.unigramCounts[sentence[0]]) - log(self.totalUnigrams) + log(0.4*0.4)
+			return self._unigramBackoff(sentence[0])
 		elif len(sentence) == 2:
-			count = self.bigramCounts[sentence[0]][sentence[1]]
-			scoreModifier = 0.4
-			if count:
-				totalCount = self.bigramsWithStartingUnigram[sentence[0]]
-			else:
-				count = self.unigramCounts[sentence[1]]
-				totalCount = self.totalUnigrams
-				scoreModifier *= 0.4
-			return log(count) - log(totalCount) + log(scoreModifier)
+			return self._bigramBackoff(sentence[0], sentence[1])
 		else:
 			for nextToken in sentence:
-				if lastToken and secondToLastToken:
-					bigram = secondToLastToken + " " + lastToken
-					count = self.trigramCounts[bigram][nextToken]
-					scoreModifier = 1
-					if count:
-						totalCount = self.trigramsWithStartingBigram[bigram]
-					else:
-						count  = self.bigramCounts[lastToken][nextToken]
-						scoreModifier *= 0.4
-						if count:
-							totalCount = self.bigramsWithStartingUnigram[lastToken]
-						else:
-							count = self.unigramCounts[nextToken]
-							totalCount = self.totalUnigrams
-							scoreModifier *= 0.4
-					score += log(count)
-					score -= log(totalCount)
-					score += log(scoreModifier)
+				if lastToken is not None and secondToLastToken is not None:
+					score += self._trigramBackoff(secondToLastToken, lastToken, nextToken)
 				secondToLastToken = lastToken
 				lastToken = nextToken
 		return score
+
+	def score_next(self, state, word):
+		'''
+			Incremental version of score: given the state of a prefix and the next word,
+			returns (logProb, newState) where logProb = score(prefix + [word]) - score(prefix),
+			so summing the logProbs of the words of a sentence gives score(sentence).
+			Each call is a constant number of lookups instead of a walk over the whole prefix.
+
+			States are opaque and hashable; START is the state of the empty sentence.
+			Prefixes that end in the same two words (of the same length class) share a state,
+			which makes the state usable as a recombination key:
+				logProb, state = langModel.score_next(LanguageModel.START, "the")
+				logProb, state = langModel.score_next(state, "house")
+		'''
+		secondToLastToken, lastToken, length = state
+		nextToken = self.store.wordId(word)
+		if length == 0:
+			logProb = self._unigramBackoff(nextToken)
+		elif length == 1:
+			logProb = self._bigramBackoff(lastToken, nextToken) - self._unigramBackoff(lastToken)
+		elif length == 2:
+			logProb = self._trigramBackoff(secondToLastToken, lastToken, nextToken) - self._bigramBackoff(secondToLastToken, lastToken)
+		else:
+			logProb = self._trigramBackoff(secondToLastToken, lastToken, nextToken)
+		return logProb, (lastToken, nextToken, min(length + 1, 3))
+
+	def score_phrase(self, state, words):
+		'''
+			score_next over several words: returns (logProb, newState) for appending words to state
+		'''
+		score = 0.0
+		for word in words:
+			logProb, state = self.score_next(state, word)
+			score += logProb
+		return score, state
+
+	def score_batch(self, context, candidates):
+		'''
+			score_next for many candidate words after the same context state: returns a NumPy array
+			with the logProb of each candidate (needs numpy). The trigrams and bigrams that can follow
+			the context are looked up once and kept in an LRU cache of contextCacheSize contexts,
+			so scoring a batch is a couple of sorted searches over those arrays.
+		'''
+		import numpy as np
+		offset, trigrams, bigrams = self._resolveContext(context)
+		store = self.store
+		ids = np.fromiter((store.wordId(word) for word in candidates), dtype=np.int64, count=len(candidates))
+		scores = np.where(ids == UNKNOWN, store.unknownLogProb, store.view("unigramLogProbs")[ids]) + LOG_BACKOFF2
+		for following, backoff in ((bigrams, LOG_BACKOFF), (trigrams, 0.0)):
+			if following is None or not len(following[0]):
+				continue
+			followingIds, logProbs = following
+			positions = np.minimum(followingIds.searchsorted(ids), len(followingIds) - 1)
+			found = followingIds[positions] == ids
+			scores[found] = logProbs[positions[found]] + backoff
+		return scores + offset
+
+	def _resolveContext(self, context):
+		'''
+			Returns (offset, trigrams, bigrams) for a state: the n-grams the next word is looked up in
+			and the constant that makes the result match score_next
+		'''
+		cache = self.contextCache
+		if context in cache:
+			resolved = cache.pop(context)
+			cache[context] = resolved
+			return resolved
+		secondToLastToken, lastToken, length = context
+		store = self.store
+		if length == 0:
+			resolved = (0.0, None, None)
+		elif length == 1:
+			resolved = (-self._unigramBackoff(lastToken), None, store.bigramsAfter(lastToken))
+		else:
+			offset = -self._bigramBackoff(secondToLastToken, lastToken) if length == 2 else 0.0
+			resolved = (offset, store.trigramsAfter(secondToLastToken, lastToken), store.bigramsAfter(lastToken))
+		cache[context] = resolved
+		if len(cache) > self.contextCacheSize:
+			cache.popitem(last=False)
+		return resolved
+
+	def state_for(self, sentence):
+		'''
+			Returns the state reached after the words of sentence (a list of words)
+		'''
+		state = LanguageModel.START
+		for word in sentence[-3:]:
+			state = (state[1], self.store.wordId(word), state[2] + 1)
+		return state
+
+	def _unigramBackoff(self, w):
+		return self.store.unigramLogProb(w) + LOG_BACKOFF2
+
+	def _bigramBackoff(self, w1, w2):
+		logProb = self.store.bigramLogProb(w1, w2)
+		if logProb is not None:
+			return logProb + LOG_BACKOFF
+		return self._unigramBackoff(w2)
+
+	def _trigramBackoff(self, w1, w2, w3):
+		logProb = self.store.trigramLogProb(w1, w2, w3)
+		if logProb is not None:
+			return logProb
+		return self._bigramBackoff(w2, w3)
+
+def compressionReport(baseline, compact, sentences):
+	'''
+		Compares two LanguageModels on held-out sentences (lists of words): returns a dictionary
+		with the n-grams and memory of both stores, the average log-prob per word under each,
+		and the mean and largest change of a sentence score.
+	'''
+	words = 0
+	before = after = 0.0
+	drift = maxDrift = 0.0
+	for sentence in sentences:
+		if not sentence:
+			continue
+		old = baseline.score(sentence)
+		new = compact.score(sentence)
+		words += len(sentence)
+		before += old
+		after += new
+		drift += abs(new - old)
+		maxDrift = max(maxDrift, abs(new - old))
+	count = len([sentence for sentence in sentences if sentence])
+	return {
+		"ngramsBefore": baseline.store.ngramCounts(),
+		"ngramsAfter": compact.store.ngramCounts(),
+		"bytesBefore": baseline.store.memoryBytes(),
+		"bytesAfter": compact.store.memoryBytes(),
+		"sentences": count,
+		"logProbBefore": before / words if words else 0.0,
+		"logProbAfter": after / words if words else 0.0,
+		"meanDrift": drift / count if count else 0.0,
+		"maxDrift": maxDrift,
+	}
+
+def printCompressionReport(report):
+	print "N-grams (1/2/3):    %d/%d/%d -> %d/%d/%d" % (report["ngramsBefore"] + report["ngramsAfter"])
+	print "Memory:             %.1f MB -> %.1f MB" % (report["bytesBefore"] / 1048576.0, report["bytesAfter"] / 1048576.0)
+	print "Held-out sentences: %d" % report["sentences"]
+	print "Log-prob per word:  %.4f -> %.4f" % (report["logProbBefore"], report["logProbAfter"])
+	print "Sentence drift:     %.4f mean, %.4f max" % (report["meanDrift"], report["maxDrift"])
+
+######FOR TESTING PURPOSES ONLY########
+def main(argv):
+	'''
+		Compiles the text n-gram files into a binary language model:
+			LanguageModel.py [-u 1.txt] [-b 2.txt] [-t 3.txt] [-c 1,2,2] [-v words.txt] [-q 256] [-w workers] [-e heldout.txt] [-o lm.bin]
+		-c are the unigram,bigram,trigram count cutoffs, -v a text file whose words make the vocabulary
+		and -q the codebook size for the log-probabilities. With -e, the result is compared to the full
+		model on the sentences of that file.
+	'''
+	opts, args = getopt.getopt(argv, "u:b:t:c:v:q:w:e:o:")
+	opts = dict(opts)
+	files = (opts.get("-u", "../pa6/ngrams/1.txt"), opts.get("-b", "../pa6/ngrams/2.txt"), opts.get("-t", "../pa6/ngrams/3.txt"))
+	cutoffs = tuple(int(cutoff) for cutoff in opts["-c"].split(",")) if "-c" in opts else None
+	vocabulary = None
+	if "-v" in opts:
+		with open(opts["-v"]) as f:
+			vocabulary = set(word for line in f for word in line.lower().split())
+	levels = int(opts["-q"]) if "-q" in opts else None
+
+	counter = readCounts(*files, workers=int(opts["-w"]) if "-w" in opts else None)
+	store = counter.store(cutoffs, vocabulary)
+	if levels:
+		store = store.quantize(levels)
+	if "-o" in opts:
+		store.save(opts["-o"])
+	if "-e" in opts:
+		with open(opts["-e"]) as f:
+			sentences = [line.lower().split() for line in f]
+		printCompressionReport(compressionReport(LanguageModel(store=counter.store()), LanguageModel(store=store), sentences))
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
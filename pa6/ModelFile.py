@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+#Compact memory-mapped file format for IBM Model One translation tables
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+import itertools as it
+from BinaryFile import BinaryFile, writeFile, stringSections
+from Corpus import MappedLines
+from CandidateIndex import MappedCandidateIndex
+from Tokenizer import VOCAB
+
+MAGIC = "MODELONE"
+VERSION = 1
+
+def isModelFile(fileName):
+	return BinaryFile.isBinary(fileName, MAGIC)
+
+def save(model, fileName, includeCorpus=False):
+	"""
+	Writes model to fileName. Layout (all sections are little-endian arrays):
+		native/foreign      sorted vocabularies, ids are positions in them
+		fwd.*               probabilityMap as CSR: row offsets per native word, foreign ids, float32 log-probs
+		rev.*               reverseMap as CSR: row offsets per foreign word, native ids, float32 log-probs
+		top.*               optional candidate index: per foreign word its k best native ids and log-probs
+		corpus.*            optional training bitext as token ids plus per-sentence offsets
+	"""
+	native_lines = _wordLines(model, model.native_lines)
+	foreign_lines = _wordLines(model, model.foreign_lines)
+	native_vocab = sorted(set(model.probabilityMap.iterkeys()) | set(w for line in native_lines for w in line))
+	foreign_vocab = sorted(set(model.reverseMap.iterkeys()) | set(w for line in foreign_lines for w in line))
+	native_ids = dict((w, i) for i, w in enumerate(native_vocab))
+	foreign_ids = dict((w, i) for i, w in enumerate(foreign_vocab))
+
+	sections = stringSections("native", native_vocab) + stringSections("foreign", foreign_vocab)
+	sections += _csrSections("fwd", model.probabilityMap, native_vocab, foreign_ids)
+	sections += _csrSections("rev", model.reverseMap, foreign_vocab, native_ids)
+	if model.candidateIndex is not None:
+		sections += _candidateSections("top", model.candidateIndex, foreign_vocab, native_ids)
+	if includeCorpus:
+		sections += _corpusSections("corpus.foreign", foreign_lines, foreign_ids)
+		sections += _corpusSections("corpus.native", native_lines, native_ids)
+	writeFile(fileName, MAGIC, VERSION, sections)
+
+def _wordLines(model, lines):
+	"""
+	Returns lines as lists of words, translating interned training lines back through VOCAB
+	"""
+	if not model.intern:
+		return lines
+	words = VOCAB.words
+	return [[words[w] for w in line] for line in lines]
+
+def _csrSections(name, table, row_vocab, col_ids):
+	offsets = [0]
+	cols = []
+	values = []
+	for word in row_vocab:
+		row = table.get(word, {}) if hasattr(table, "get") else table[word]
+		for col_id, value in sorted((col_ids[w], v) for w, v in row.iteritems()):
+			cols.append(col_id)
+			values.append(value)
+		offsets.append(len(cols))
+	return [(name + ".off", "Q", offsets), (name + ".col", "I", cols), (name + ".val", "f", values)]
+
+def _candidateSections(name, index, foreign_vocab, native_ids):
+	offsets = [0]
+	natives = []
+	values = []
+	for word in foreign_vocab:
+		for native_w, value in index[word]:
+			natives.append(native_ids[native_w])
+			values.append(value)
+		offsets.append(len(natives))
+	return [(name + ".k", "I", [index.k]), (name + ".off", "Q", offsets), (name + ".col", "I", natives), (name + ".val", "f", values)]
+
+def _corpusSections(name, lines, ids):
+	offsets = [0]
+	tokens = []
+	for line in lines:
+		tokens.extend(ids[w] for w in line)
+		offsets.append(len(tokens))
+	return [(name + ".off", "Q", offsets), (name + ".tok", "I", tokens)]
+
+def load(fileName):
+	"""
+	Maps fileName and returns (probabilityMap, reverseMap, foreign_lines, native_lines, candidateIndex).
+	The maps are MappedTables; the lines are MappedLines, or empty lists when the corpus was not saved;
+	candidateIndex is None when the model was saved without one.
+	"""
+	f = BinaryFile(fileName, MAGIC)
+	if f.version > VERSION:
+		raise ValueError(fileName + " was written by a newer version (" + str(f.version) + ")")
+	native_vocab = f.strings("native")
+	foreign_vocab = f.strings("foreign")
+	probabilityMap = MappedTable(native_vocab, foreign_vocab, f.section("fwd.off"), f.section("fwd.col"), f.section("fwd.val"))
+	reverseMap = MappedTable(foreign_vocab, native_vocab, f.section("rev.off"), f.section("rev.col"), f.section("rev.val"))
+	foreign_lines, native_lines = [], []
+	if "corpus.foreign.off" in f:
+		foreign_lines = MappedLines(foreign_vocab, f.section("corpus.foreign.off"), f.section("corpus.foreign.tok"))
+		native_lines = MappedLines(native_vocab, f.section("corpus.native.off"), f.section("corpus.native.tok"))
+	candidateIndex = None
+	if "top.off" in f:
+		candidateIndex = MappedCandidateIndex(f.section("top.k")[0], foreign_vocab, native_vocab, f.section("top.off"), f.section("top.col"), f.section("top.val"))
+	return probabilityMap, reverseMap, foreign_lines, native_lines, candidateIndex
+
+class MappedTable:
+	"""
+	Read-only stand-in for the defaultdict of Counters of a trained model: table[row_word] returns a
+	MappedRow. Unknown words give an empty row and, unlike the defaultdict, are not inserted.
+	Rows are kept in self.rows once looked up, so only the rows actually used are ever decoded.
+	"""
+	def __init__(self, row_vocab, col_vocab, offsets, cols, values):
+		self.row_vocab = row_vocab
+		self.col_vocab = col_vocab
+		self.offsets = offsets
+		self.cols = cols
+		self.values = values
+		self.rows = {}
+
+	def __getitem__(self, word):
+		row = self.rows.get(word)
+		if row is None:
+			row_id = self.row_vocab.index(word)
+			if row_id < 0:
+				return MappedRow(self, 0, 0)
+			row = self.rows[word] = self._row(row_id)
+		return row
+
+	def _row(self, row_id):
+		start, end = self.offsets[row_id:row_id + 2]
+		return MappedRow(self, start, end)
+
+	def get(self, word, default=None):
+		if word in self:
+			return self[word]
+		return default
+
+	def __contains__(self, word):
+		return word in self.rows or self.row_vocab.index(word) >= 0
+
+	def __len__(self):
+		return len(self.row_vocab)
+
+	def __iter__(self):
+		return iter(self.row_vocab)
+
+	def iterkeys(self):
+		return iter(self.row_vocab)
+
+	def iteritems(self):
+		#full scans decode every row once and leave self.rows alone
+		for row_id, word in enumerate(self.row_vocab):
+			row = self.rows.get(word)
+			yield word, row if row is not None else self._row(row_id)
+
+class MappedRow(dict):
+	"""
+	One row of a MappedTable, behaving like the Counter it replaces: row[word] is the log-probability,
+	or 0 when the pair never co-occurred. The row is decoded into the dictionary when it is created,
+	so lookups cost the same as with the in-memory model; iteration follows the order of the file.
+	"""
+	def __init__(self, table, start, end):
+		col_vocab = table.col_vocab
+		dict.__init__(self, it.izip([col_vocab[col_id] for col_id in table.cols[start:end]], table.values[start:end]))
+		self.table = table
+		self.start = start
+		self.end = end
+
+	def __missing__(self, word):
+		return 0
+
+	def __iter__(self):
+		return self.iterkeys()
+
+	def iterkeys(self):
+		col_vocab = self.table.col_vocab
+		for col_id in self.table.cols[self.start:self.end]:
+			yield col_vocab[col_id]
+
+	def iteritems(self):
+		return it.izip(self.iterkeys(), self.table.values[self.start:self.end])
+
+	def keys(self):
+		return list(self.iterkeys())
+
+	def values(self):
+		return self.table.values[self.start:self.end]
+
+	def items(self):
+		return list(self.iteritems())
+
+	def most_common(self, n=None):
+		items = sorted(self.iteritems(), key=lambda item: item[1], reverse=True)
+		return items if n is None else items[:n]
@@ -7,13 +7,150 @@ import itertools as it
 import collections
 import math
 import cPickle as pickle
-import re
+import os
+import time
+import resource
+import ModelFile
+import Pruning
+from Corpus import openCorpus, ConcatLines
+from CandidateIndex import CandidateIndex
+from Tokenizer import tokenize, tokenizeBatch, VOCAB
+
+CANDIDATE_COUNT = 50 #Best native words per foreign word kept in the candidate index
 
 def getDict():
 	return collections.Counter()
 
+def getFloatDict():
+	return collections.defaultdict(float)
+
+def peakMemoryMB():
+	"""
+	Peak resident memory of this process or any finished child process, in megabytes
+	"""
+	return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024.0
+
+def formatStats(stats):
+	line = "Iteration: %d" % stats["iteration"]
+	if stats["logLikelihood"] is not None:
+		line += "  log-likelihood: %.2f  perplexity: %.3f  max change: %.6f" % (stats["logLikelihood"], stats["perplexity"], stats["maxChange"])
+	return line + "  time: %.2fs  peak memory: %.1f MB" % (stats["seconds"], stats["peakMemoryMB"])
+
+class DictEM:
+	"""
+	Reference EM engine: t(f|e) is kept in nested defaultdicts keyed by the words themselves.
+	The first call to iterate() builds the normalized co-occurrence table, every following
+	call runs one E-step and one M-step over the bitext.
+	"""
+	def __init__(self, foreign_lines, native_lines):
+		self.foreign_lines = foreign_lines
+		self.native_lines = native_lines
+		self.initMap = None
+
+	def iterate(self):
+		"""
+		Runs one iteration. Returns (logLikelihood, words, maxChange): the corpus log-likelihood under
+		the table the E-step used, the number of foreign words it covers and the largest change of
+		any t(f|e). They are (None, 0, None) for the initialization.
+		"""
+		if self.initMap is None:
+			self._initialize()
+			return None, 0, None
+		initMap = self.initMap
+		wordCounts = collections.defaultdict(getFloatDict)
+		nativeTotal = collections.defaultdict(float)
+		logLikelihood = 0.0
+		words = 0
+		for foreign_s, native_s in it.izip(self.foreign_lines, self.native_lines):
+			total_s = collections.defaultdict(float)
+			for foreign_w in foreign_s:
+				t_sum = 0.0
+				for native_w in native_s:
+					t_sum += initMap[native_w][foreign_w]
+				total_s[foreign_w] += t_sum
+				logLikelihood += math.log(t_sum)
+			if foreign_s:
+				logLikelihood -= len(foreign_s) * math.log(len(native_s))
+				words += len(foreign_s)
+			for foreign_w in foreign_s:
+				for native_w in native_s:
+					wordCounts[native_w][foreign_w] += (initMap[native_w][foreign_w]/total_s[foreign_w])
+					nativeTotal[native_w] += (initMap[native_w][foreign_w]/total_s[foreign_w])
+		maxChange = 0.0
+		for native_w, n_value in nativeTotal.iteritems():
+			foreign_dict = initMap[native_w]
+			for foreign_w, f_value in wordCounts[native_w].iteritems():
+				value = f_value / n_value
+				maxChange = max(maxChange, abs(value - foreign_dict[foreign_w]))
+				foreign_dict[foreign_w] = value
+		return logLikelihood, words, maxChange
+
+	def _initialize(self):
+		"""
+		Initializes t(f|e) uniformly, which is the same as the first iteration
+		"""
+		initMap = collections.defaultdict(getFloatDict)
+		for native_s, foreign_s in it.izip(self.native_lines, self.foreign_lines):
+			for native_w in native_s:
+				for foreign_w in foreign_s:
+					initMap[native_w][foreign_w] += 1.0
+		#normalize
+		for native_w, foreign_dict in initMap.iteritems():
+			w_sum = sum(foreign_dict.values())
+			for foreign_w in foreign_dict.keys():
+				foreign_dict[foreign_w] = foreign_dict[foreign_w]/w_sum
+		self.initMap = initMap
+
+	def table(self):
+		"""
+		Returns t(f|e) as a map that can be indexed [native_word][foreign_word]
+		"""
+		if self.initMap is None:
+			self._initialize()
+		return self.initMap
+
+	def close(self):
+		"""
+		Releases the engine's resources, nothing to do here
+		"""
+		pass
+
+	def setTable(self, table):
+		"""
+		Warm-starts the engine from a previous t(f|e). Pairs that are not in table (e.g. from newly
+		added sentences) keep their co-occurrence initialization, then every row is renormalized.
+		"""
+		self._initialize()
+		for native_w, foreign_dict in self.initMap.iteritems():
+			known = table.get(native_w, {})
+			for foreign_w in foreign_dict.keys():
+				foreign_dict[foreign_w] = known.get(foreign_w, foreign_dict[foreign_w])
+			w_sum = sum(foreign_dict.values())
+			for foreign_w in foreign_dict.keys():
+				foreign_dict[foreign_w] = foreign_dict[foreign_w]/w_sum
+
+def _mergeTables(table, previousTable):
+	"""
+	Returns table with the pairs of previousTable it does not have: rows of native words missing
+	from table are copied as they are, missing pairs of shared rows are added and the row renormalized
+	"""
+	merged = dict(table)
+	for native_w, previous_dict in previousTable.iteritems():
+		foreign_dict = table.get(native_w)
+		if not foreign_dict:
+			merged[native_w] = previous_dict
+			continue
+		missing = [foreign_w for foreign_w in previous_dict if foreign_w not in foreign_dict]
+		if missing:
+			foreign_dict = dict(foreign_dict)
+			for foreign_w in missing:
+				foreign_dict[foreign_w] = previous_dict[foreign_w]
+			w_sum = sum(foreign_dict.values())
+			merged[native_w] = dict((foreign_w, value / w_sum) for foreign_w, value in foreign_dict.iteritems())
+	return merged
+
 class ModelOne:
-	def __init__(self, foreign_file=None, native_file=None, loadFile=None, iterations=5, Verbose=False):
+	def __init__(self, foreign_file=None, native_file=None, loadFile=None, iterations=5, Verbose=False, engine="dict", workers=None, corpusDir=None, checkpointFile=None, intern=False, tolerance=None):
 		"""
 		To use: In the import, you MUST also import getDict:
 			from ModelOne import ModelOne, getDict'
@@ -23,13 +160,33 @@ class ModelOne:
 
 		To save to a file:
 			MyModel.saveToFile("save.model")
+		Saved models are memory-mapped on load; pass includeCorpus=True to also keep the training bitext.
 
 		foreign_file: path to the foreign language part of the bitext - default is None
 
 		native_file: path to the native language part of the bitext - default is None
 		
 		iterations: number of EM iterations the user wishes to complete, default is 5
-		Verbose: Set to True for debug information, default is False.
+		Verbose: Set to True for debug information, default is False. Every iteration prints the
+			corpus log-likelihood, perplexity, largest change of t(f|e), time and peak memory;
+			the same numbers are kept in myModel.trainingLog.
+		tolerance: if set, training stops early once an iteration improves the log-likelihood by
+			less than this fraction, e.g. 0.001.
+		engine: "dict" trains with nested dictionaries, "sparse" maps words to integer ids and runs
+			every EM step as a batched NumPy operation (needs numpy), "parallel" splits the bitext
+			into shards and computes the expected counts in a process pool (needs numpy). All give the same model.
+		workers: number of processes used by the "parallel" engine, default is one per core.
+		corpusDir: if set, the bitext is tokenized once into memory-mapped corpus files in this
+			directory and training streams over them instead of keeping every sentence in memory.
+		checkpointFile: if set, t(f|e) is saved there after every iteration, and if the file already
+			exists training resumes from it instead of starting over.
+		intern: if True, the training lines hold Tokenizer.VOCAB ids instead of strings so EM hashes
+			ints; the trained maps are still indexed by words. The ids stay inside ModelOne: the
+			language model and the phrase table do not use them.
+
+		To train an existing model for more iterations, or to add sentence pairs to it:
+			MyModel.continueTraining(2)
+			MyModel.extend("more.es", "more.en", iterations=2)
 
 		Example:
 			MyModel = ModelOne("../pa6/stuff.es", "../pa6/stuff.en")
@@ -43,12 +200,25 @@ class ModelOne:
 		Caution: if the log-probability does not exist - it won't return float('-inf') so please
 		check beforehand to see if something is in there: 
 			myModel[existent_word].get(fakeword, float('-inf'))
+
+		For the best translations of a foreign word use myModel.candidates(foreign_word), which reads
+		a precomputed top-k index (see buildCandidateIndex) and never modifies the model.
 		"""
 		#create necessary maps here
 		self.foreign_lines = []
 		self.native_lines = []
 		self.probabilityMap = collections.defaultdict(getDict)
 		self.reverseMap = collections.defaultdict(getDict)
+		self.candidateIndex = None
+		self.engine = engine
+		self.workers = workers
+		self.corpusDir = corpusDir
+		self.checkpointFile = checkpointFile
+		self.intern = intern
+		self.tolerance = tolerance
+		self.trainingLog = []
+		self.iterationsDone = 0
+		self.trainingFiles = [] #(absolute path, size) of every file the training lines were read from
 		if loadFile:
 			self.loadFromFile(loadFile)
 		elif foreign_file and native_file:
@@ -58,19 +228,29 @@ class ModelOne:
 	def loadFromFile(self, fileName):
 		"""
 		Loads a precomputed translation model from the disk.
+		Binary model files are memory-mapped, so the tables are read lazily on access;
+		older pickled models are still loaded whole.
 		"""
+		if ModelFile.isModelFile(fileName):
+			self.probabilityMap, self.reverseMap, self.foreign_lines, self.native_lines, self.candidateIndex = ModelFile.load(fileName)
+			return
 		mapList = pickle.load( open( fileName, "rb"))
 		self.probabilityMap = mapList[0]
 		self.reverseMap = mapList[1]
 		self.foreign_lines = mapList[2]
 		self.native_lines = mapList[3]
 
-	def saveToFile(self, fileName):
+	def saveToFile(self, fileName, includeCorpus=False, candidateCount=CANDIDATE_COUNT):
 		"""
-		Saves the data within this translation model to the disk.
+		Saves the data within this translation model to the disk, in the binary format of ModelFile.
+		The training corpus is only stored when includeCorpus is True.
+		The candidate index is saved too, built first with k = candidateCount if the model has none
+		or one of another k, so loading the model does not have to build it. candidateCount None
+		saves only an index that already exists.
 		"""
-		mapList = [self.probabilityMap, self.reverseMap, self.foreign_lines, self.native_lines]
-		pickle.dump( mapList, open(fileName, "wb"), protocol=pickle.HIGHEST_PROTOCOL)
+		if candidateCount and (self.candidateIndex is None or self.candidateIndex.k != candidateCount):
+			self.buildCandidateIndex(candidateCount)
+		ModelFile.save(self, fileName, includeCorpus)
 
 	def processSentence(self, line):
 		"""
@@ -78,79 +258,228 @@ class ModelOne:
 		Removes numbers and punctuation.
 		Returns a list of words
 		"""
-		#print line.lower()
-		removeNumbers = r'(\d[\d\.\,\%]*[ .]\%? ?)|( \d[\d\.\,\%]*)'
-		removePunctuation = r'(&.*?;)|( ?[\.\,\:\?])|¿\ | \-|\- '
-		return re.sub(removeNumbers + '|' + removePunctuation, "", line.lower().strip()).split()
-
+		return tokenize(line)
 
 	def readFile(self, foreignName, nativeName):
 		"""
 		Loads in training data as list of lines - foreignName is the name of the file
-		for the foreign text and nativeName is the name of the file for the native text
+		for the foreign text and nativeName is the name of the file for the native text.
+		With a corpusDir the lines are Corpus objects backed by files on disk instead,
+		with intern they are lists of VOCAB ids.
 		"""
+		self.trainingFiles += [(os.path.abspath(name), os.path.getsize(name)) for name in (foreignName, nativeName)]
+		if self.corpusDir:
+			self.foreign_lines = openCorpus(foreignName, self.corpusDir, self.processSentence)
+			self.native_lines = openCorpus(nativeName, self.corpusDir, self.processSentence, prefix=["<NULL>"])
+			return
 		with open(foreignName) as f:
-			for line in f:
-				words = self.processSentence(line)
-				self.foreign_lines.append(words)
+			for words in tokenizeBatch(f):
+				self.foreign_lines.append(VOCAB.internSentence(words) if self.intern else words)
 		with open(nativeName) as n:
-			for line in n:
-				words = ["<NULL>"]
-				words += self.processSentence(line)
-				self.native_lines.append(words)
+			for words in tokenizeBatch(n):
+				words = ["<NULL>"] + words
+				self.native_lines.append(VOCAB.internSentence(words) if self.intern else words)
 
 	def train(self, iterations, Verbose=False):
 		"""
 		Trains the data and returns a map that can be indexed ["native word"]["foreign word"]
 		and gets the log probablity of that word alignment
 		"""
-		iterations -= 1
-		if Verbose:
-			print "Iteration: ", 1
+		engine = self._createEngine()
+		self.iterationsDone = 0
+		if self.checkpointFile and os.path.exists(self.checkpointFile):
+			self.iterationsDone, table = self._loadCheckpoint()
+			if Verbose:
+				print "Resuming after iteration ", self.iterationsDone
+			engine.setTable(self._encodeTable(table))
+		self._runEM(engine, iterations - self.iterationsDone, Verbose)
 
-		# initialize t(f|e) uniformly / first iteration
-		initMap = collections.defaultdict(lambda:collections.defaultdict(lambda: 0.0))
-		for native_s, foreign_s in it.izip(self.native_lines, self.foreign_lines):
-			for native_w in native_s:
-				for foreign_w in foreign_s:
-					initMap[native_w][foreign_w] += 1.0
-		#normalize
-		self._normalize(initMap)
+	def continueTraining(self, iterations, Verbose=False):
+		"""
+		Runs more EM iterations starting from the current model instead of a uniform initialization.
+		Needs the training corpus: a model saved without includeCorpus=True can only be extended.
+		"""
+		if not len(self.foreign_lines):
+			raise ValueError("The model has no training corpus to continue training on: save it with includeCorpus=True, or use extend() with new sentences")
+		engine = self._createEngine()
+		engine.setTable(self._encodeTable(self._tTable()))
+		self._runEM(engine, iterations, Verbose)
 
-		for iteration in xrange(iterations):
-			if Verbose:
-				print "Iteration: ", (iteration + 2)
-			wordCounts = collections.defaultdict(lambda:collections.defaultdict(lambda: 0.0))
-			nativeTotal = collections.defaultdict(lambda: 0.0)
-			for foreign_s, native_s in it.izip(self.foreign_lines, self.native_lines):
-				total_s = collections.defaultdict(lambda: 0.0)
-				for foreign_w in foreign_s:
-					for native_w in native_s:
-						total_s[foreign_w] += initMap[native_w][foreign_w]
-				for foreign_w in foreign_s:
-					for native_w in native_s:
-						wordCounts[native_w][foreign_w] += (initMap[native_w][foreign_w]/total_s[foreign_w])
-						nativeTotal[native_w] += (initMap[native_w][foreign_w]/total_s[foreign_w])
-			for native_w, n_value in nativeTotal.iteritems():
-				for foreign_w, f_value in wordCounts[native_w].iteritems():
-					initMap[native_w][foreign_w] = f_value / n_value
+	def extend(self, foreign_file, native_file, iterations=1, Verbose=False):
+		"""
+		Appends a bitext to the training data and continues training from the current model.
+		Pairs that only occur in the new sentences start from their co-occurrence counts.
+		A model loaded without its corpus is only trained on the new sentences; the pairs these do not
+		contain keep their current t(f|e) (see _mergeTables).
+		"""
+		table = self._tTable()
+		old_foreign, old_native = self.foreign_lines, self.native_lines
+		self.foreign_lines, self.native_lines = [], []
+		self.readFile(foreign_file, native_file)
+		self.foreign_lines = ConcatLines(old_foreign, self.foreign_lines)
+		self.native_lines = ConcatLines(old_native, self.native_lines)
+		engine = self._createEngine()
+		engine.setTable(self._encodeTable(table))
+		self._runEM(engine, iterations, Verbose, table)
+
+	def _runEM(self, engine, iterations, Verbose, previousTable=None):
+		"""
+		Runs the engine for up to iterations iterations, recording one entry per iteration in
+		trainingLog and stopping early once the relative log-likelihood gain drops below tolerance.
+		The pairs of previousTable that the engine's corpus does not contain are kept in the result.
+		"""
+		try:
+			previous = None
+			for iteration in xrange(iterations):
+				self.iterationsDone += 1
+				start = time.time()
+				logLikelihood, words, maxChange = engine.iterate()
+				stats = {
+					"iteration": self.iterationsDone,
+					"logLikelihood": logLikelihood,
+					"perplexity": math.exp(-logLikelihood / words) if words else None,
+					"maxChange": maxChange,
+					"seconds": time.time() - start,
+					"peakMemoryMB": peakMemoryMB(),
+				}
+				self.trainingLog.append(stats)
+				if Verbose:
+					print formatStats(stats)
+				if self.checkpointFile:
+					self._saveCheckpoint(self._decodeTable(engine.table()))
+				if self.tolerance is not None and previous is not None and logLikelihood is not None:
+					if (logLikelihood - previous) / abs(previous) < self.tolerance:
+						if Verbose:
+							print "Converged after iteration ", self.iterationsDone
+						break
+				previous = logLikelihood
+		finally:
+			engine.close()
 
 		if Verbose:
 			print "Sorting and reversing dictionary..."
-		for native_w, foreign_dict in initMap.iteritems():
-			for foreign_w, value in foreign_dict.iteritems():
-				newVal = math.log(value)
-				self.probabilityMap[native_w][foreign_w] = newVal
-				self.reverseMap[foreign_w][native_w] = newVal
+		table = self._decodeTable(engine.table())
+		if previousTable:
+			table = _mergeTables(table, previousTable)
+		self._storeTable(table)
 
-	def _normalize(self, initMap):
+	def _saveCheckpoint(self, table):
 		"""
-		Normalizes initMap so that the values of model["word"] sum to one
+		Atomically replaces checkpointFile with the current t(f|e)
 		"""
-		for native_w, foreign_dict in initMap.iteritems():
-			w_sum = sum(foreign_dict.values())
-			for foreign_w in foreign_dict.keys():
-				initMap[native_w][foreign_w] = initMap[native_w][foreign_w]/w_sum
+		tmpName = self.checkpointFile + ".tmp"
+		with open(tmpName, "wb") as f:
+			checkpoint = [self.iterationsDone, table, self._corpusId()]
+			pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+		os.rename(tmpName, self.checkpointFile)
+
+	def _loadCheckpoint(self):
+		"""
+		Returns (iterationsDone, table) of checkpointFile. Raises ValueError if the checkpoint
+		was written while training on another corpus.
+		"""
+		with open(self.checkpointFile, "rb") as f:
+			checkpoint = pickle.load(f)
+		if len(checkpoint) < 3 or checkpoint[2] != self._corpusId():
+			raise ValueError("Checkpoint " + self.checkpointFile + " was not written while training on this corpus, remove it to start over")
+		return checkpoint[0], checkpoint[1]
+
+	def _corpusId(self):
+		"""
+		Identifies the training corpus in checkpoints: its files (path and size) and number of sentences
+		"""
+		return [list(info) for info in self.trainingFiles] + [len(self.foreign_lines)]
+
+	def _decodeTable(self, table):
+		"""
+		Returns table keyed by words, translating VOCAB ids if the training lines are interned
+		"""
+		if not self.intern:
+			return table
+		words = VOCAB.words
+		return dict((words[native_id], dict((words[foreign_id], value) for foreign_id, value in foreign_dict.iteritems())) for native_id, foreign_dict in table.iteritems())
+
+	def _encodeTable(self, table):
+		"""
+		Inverse of _decodeTable: keys table by VOCAB ids if the training lines are interned
+		"""
+		if not self.intern:
+			return table
+		return dict((VOCAB.id(native_w), dict((VOCAB.id(foreign_w), value) for foreign_w, value in foreign_dict.iteritems())) for native_w, foreign_dict in table.iteritems())
+
+	def _tTable(self):
+		"""
+		Returns the current t(f|e) (not log) as nested dictionaries
+		"""
+		table = {}
+		for native_w, foreign_dict in self.probabilityMap.iteritems():
+			table[native_w] = dict((foreign_w, math.exp(value)) for foreign_w, value in foreign_dict.iteritems())
+		return table
+
+	def prune(self, threshold=None, topK=None, cumulativeMass=None):
+		"""
+		Drops unlikely entries from probabilityMap and rebuilds reverseMap from what is left.
+		For every native word, keeps t(f|e) >= threshold, at most topK entries and only the best entries
+		holding cumulativeMass of the row (see Pruning.pruneTable). Use Pruning.pruningReport
+		to see the memory saved and how candidate lookups change.
+		"""
+		self.probabilityMap, self.reverseMap = Pruning.pruneTable(self.probabilityMap, threshold, topK, cumulativeMass)
+		self.candidateIndex = None
+
+	def compact(self, storage="float32"):
+		"""
+		Replaces the nested Counters by read-only array-backed tables holding "float32" or 8-bit
+		quantized ("uint8") log-probabilities. Lookups work as before but the tables become read-only.
+		"""
+		self.probabilityMap = Pruning.compactTable(self.probabilityMap, storage)
+		self.reverseMap = Pruning.compactTable(self.reverseMap, storage)
+
+	def buildCandidateIndex(self, k=CANDIDATE_COUNT):
+		"""
+		Precomputes the k best native words of every foreign word. The index is saved with the model.
+		"""
+		self.candidateIndex = CandidateIndex.fromTable(self.reverseMap, k)
+
+	def candidates(self, foreign_w):
+		"""
+		Returns a tuple of the best (native_word, log-probability) pairs for foreign_w, best first,
+		or an empty tuple for unknown words. Builds a candidate index with the default k if there is none.
+		"""
+		if self.candidateIndex is None:
+			self.buildCandidateIndex()
+		return self.candidateIndex[foreign_w]
+
+	def _createEngine(self):
+		"""
+		Returns the EM engine selected in the constructor
+		"""
+		if self.engine == "dict":
+			return DictEM(self.foreign_lines, self.native_lines)
+		elif self.engine == "sparse":
+			from SparseEM import SparseEM
+			return SparseEM(self.foreign_lines, self.native_lines)
+		elif self.engine == "parallel":
+			from ParallelEM import ParallelEM
+			return ParallelEM(self.foreign_lines, self.native_lines, self.workers)
+		raise ValueError("Unknown training engine: " + str(self.engine))
+
+	def _storeTable(self, initMap):
+		"""
+		Fills probabilityMap and reverseMap with the log of the trained t(f|e)
+		"""
+		self._storeEntries((native_w, foreign_w, value) for native_w, foreign_dict in initMap.iteritems() for foreign_w, value in foreign_dict.iteritems())
+
+	def _storeEntries(self, entries):
+		"""
+		Same as _storeTable, for t(f|e) given as an iterable of (native_w, foreign_w, value)
+		"""
+		self.probabilityMap = collections.defaultdict(getDict)
+		self.reverseMap = collections.defaultdict(getDict)
+		self.candidateIndex = None
+		for native_w, foreign_w, value in entries:
+			newVal = math.log(value)
+			self.probabilityMap[native_w][foreign_w] = newVal
+			self.reverseMap[foreign_w][native_w] = newVal
 
 	def __getitem__(self, index):
 		return self.probabilityMap[index]
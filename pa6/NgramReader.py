@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+#Parallel and compressed reading of the n-gram count files for the Language Model
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+import io
+import os
+import bz2
+import gzip
+import array
+import itertools as it
+import multiprocessing
+from NgramStore import NgramCounter, packBigram, packTrigram, BITS, MAX_WORDS
+from Tokenizer import Vocabulary
+
+CHUNK_BYTES = 32 << 20      # plain files larger than this are parsed in several byte ranges
+
+#magic bytes of the compressed formats we read
+GZIP_MAGIC = "\x1f\x8b"
+BZ2_MAGIC = "BZh"
+XZ_MAGIC = "\xfd7zXZ\x00"
+
+def openCounts(fileName):
+	"""
+	Opens an n-gram count file for reading lines, plain or compressed with gzip, bzip2 or xz.
+	The format is recognized from the first bytes of the file, not from its name.
+	xz needs the lzma module (Python 3, or backports.lzma on Python 2).
+	"""
+	with open(fileName, "rb") as f:
+		head = f.read(6)
+	if head.startswith(GZIP_MAGIC):
+		#GzipFile reads lines in Python, a buffered reader over it is several times faster
+		return io.BufferedReader(gzip.open(fileName, "rb"))
+	if head.startswith(BZ2_MAGIC):
+		return bz2.BZ2File(fileName, "rb")
+	if head.startswith(XZ_MAGIC):
+		try:
+			import lzma
+		except ImportError:
+			try:
+				from backports import lzma
+			except ImportError:
+				raise ValueError(fileName + " is xz compressed, reading it needs the lzma module (pip install backports.lzma)")
+		return lzma.LZMAFile(fileName, "rb")
+	return open(fileName, "rb")
+
+def isCompressed(fileName):
+	with open(fileName, "rb") as f:
+		head = f.read(6)
+	return head.startswith(GZIP_MAGIC) or head.startswith(BZ2_MAGIC) or head.startswith(XZ_MAGIC)
+
+def readCounts(unigram_file, bigram_file, trigram_file, workers=None, chunkBytes=CHUNK_BYTES):
+	"""
+	Reads the "token count", "count token1 token2" and "count token1 token2 token3" files
+	(plain or compressed) into an NgramCounter.
+	With more than one worker (default: one per core) the files are parsed in a process pool:
+	every file is a task, and plain files larger than chunkBytes are split into byte ranges
+	that are parsed separately. The partial counts are then merged (needs numpy).
+	"""
+	workers = workers or multiprocessing.cpu_count()
+	if workers > 1:
+		return _readParallel((unigram_file, bigram_file, trigram_file), workers, chunkBytes)
+	counter = NgramCounter()
+	with openCounts(unigram_file) as u:
+		for line in u:
+			token, count = line.split()
+			counter.addUnigram(token, int(count))
+	with openCounts(bigram_file) as b:
+		for line in b:
+			count, token1, token2 = line.split()
+			counter.addBigram(token1, token2, int(count))
+	with openCounts(trigram_file) as t:
+		for line in t:
+			count, token1, token2, token3 = line.split()
+			counter.addTrigram(token1, token2, token3, int(count))
+	return counter
+
+def chunkTasks(fileName, order, chunkBytes=CHUNK_BYTES):
+	"""
+	Returns the (fileName, order, start, end) parsing tasks of one file: byte ranges of about
+	chunkBytes for a plain file, the whole file (end None) for a compressed one
+	"""
+	size = os.path.getsize(fileName)
+	if isCompressed(fileName) or size <= chunkBytes:
+		return [(fileName, order, 0, None)]
+	return [(fileName, order, start, min(start + chunkBytes, size)) for start in xrange(0, size, chunkBytes)]
+
+def _lines(task):
+	"""
+	Yields the lines of a task. A line belongs to the byte range it starts in, so a range skips
+	the line running into it and finishes the one running out of it.
+	"""
+	fileName, order, start, end = task
+	if end is None:
+		with openCounts(fileName) as f:
+			for line in f:
+				yield line
+		return
+	with open(fileName, "rb") as f:
+		position = start
+		if start > 0:
+			f.seek(start - 1)
+			position += len(f.readline()) - 1
+		while position < end:
+			line = f.readline()
+			if not line:
+				break
+			position += len(line)
+			yield line
+
+def _parseChunk(task):
+	"""
+	Runs in a worker. Parses one task into its own vocabulary and returns
+	(words, packed keys, counts) with keys and counts as NumPy arrays
+	"""
+	import numpy as np
+	order = task[1]
+	vocab = Vocabulary()
+	wordId = vocab.id
+	keys = array.array("l")
+	counts = array.array("l")
+	if order == 1:
+		for line in _lines(task):
+			token, count = line.split()
+			keys.append(wordId(token))
+			counts.append(int(count))
+	elif order == 2:
+		for line in _lines(task):
+			count, token1, token2 = line.split()
+			keys.append(packBigram(wordId(token1), wordId(token2)))
+			counts.append(int(count))
+	else:
+		for line in _lines(task):
+			count, token1, token2, token3 = line.split()
+			keys.append(packTrigram(wordId(token1), wordId(token2), wordId(token3)))
+			counts.append(int(count))
+	return vocab.words, np.frombuffer(keys, dtype=np.int64), np.frombuffer(counts, dtype=np.int64)
+
+def _readParallel(files, workers, chunkBytes):
+	import numpy as np
+	tasks = []
+	for order, fileName in enumerate(files, 1):
+		tasks.extend(chunkTasks(fileName, order, chunkBytes))
+	pool = multiprocessing.Pool(min(workers, len(tasks)))
+	try:
+		results = pool.map(_parseChunk, tasks, chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+
+	counter = NgramCounter()
+	mask = MAX_WORDS - 1
+	parts = {1: ([], []), 2: ([], []), 3: ([], [])}
+	for (fileName, order, start, end), (words, keys, counts) in it.izip(tasks, results):
+		#renumber the chunk's word ids into the counter's vocabulary
+		remap = np.fromiter((counter.vocab.id(word) for word in words), dtype=np.int64, count=len(words))
+		if order == 1:
+			keys = remap[keys]
+		elif order == 2:
+			keys = (remap[keys >> BITS] << BITS) | remap[keys & mask]
+		else:
+			keys = (((remap[keys >> 2 * BITS] << BITS) | remap[(keys >> BITS) & mask]) << BITS) | remap[keys & mask]
+		parts[order][0].append(keys)
+		parts[order][1].append(counts)
+	if len(counter.vocab) > MAX_WORDS:
+		raise ValueError("Too many words for the n-gram store: %d (at most %d)" % (len(counter.vocab), MAX_WORDS))
+
+	for order, ngramCounts in ((1, counter.unigramCounts), (2, counter.bigramCounts), (3, counter.trigramCounts)):
+		keys, counts = parts[order]
+		keys = np.concatenate(keys)
+		counts = np.concatenate(counts)
+		if not len(keys):
+			continue
+		#the same n-gram may be listed more than once: sum its counts
+		ordering = np.argsort(keys, kind="mergesort")
+		keys = keys[ordering]
+		counts = counts[ordering]
+		starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+		ngramCounts.update(it.izip(keys[starts].tolist(), np.add.reduceat(counts, starts).tolist()))
+	return counter
+
+######FOR TESTING PURPOSES ONLY########
+def main():
+	import sys
+	import time
+	unigram_file, bigram_file, trigram_file = sys.argv[1:4]
+	workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+	start = time.time()
+	counter = readCounts(unigram_file, bigram_file, trigram_file, workers)
+	print "Read %d words, %d bigrams, %d trigrams in %.2fs" % (len(counter.vocab), len(counter.bigramCounts), len(counter.trigramCounts), time.time() - start)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,370 @@
+#!/usr/bin/env python
+#Compact read-only n-gram count store for the Language Model
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+import sys
+import array
+import bisect
+import collections
+import itertools as it
+from math import log
+from BinaryFile import BinaryFile, MappedArray, SortedWords, writeFile, stringSections
+from Tokenizer import Vocabulary
+from Pruning import QuantizedArray
+
+BITS = 21                   # bits per word id in a packed n-gram key
+MAX_WORDS = 1 << BITS
+UNKNOWN = -1
+MAGIC = "NGRAMLM1"
+VERSION = 1
+
+def packBigram(id1, id2):
+	return (id1 << BITS) | id2
+
+def packTrigram(id1, id2, id3):
+	return (((id1 << BITS) | id2) << BITS) | id3
+
+class NgramStore:
+	"""
+	Unigram, bigram and trigram counts over a sorted vocabulary. Words are ids into the vocabulary
+	and n-grams are packed into one int (BITS bits per word), kept in sorted arrays next to their counts:
+		unigrams        count + 1 per word id (Laplace smoothing; unknown words count 1)
+		bigramKeys      packed (w1, w2), sorted, with bigramCounts
+		bigramTotals    per word id, total count of the bigrams it starts
+		trigramKeys     packed (w1, w2, w3), sorted, with trigramCounts
+		contextKeys     packed (w1, w2) of every trigram context, sorted, with contextTotals
+	Next to the counts, the conditional log-probabilities log(count) - log(total) of every n-gram
+	are precomputed. Every lookup is a binary search or an index, so scoring never adds anything
+	to the store. save() writes all arrays to one binary file that load() maps back in.
+	A store built with cutoffs or a vocabulary (see NgramCounter.store) holds fewer n-grams, and
+	quantize() trades the exact log-probabilities for one-byte codes.
+	"""
+	def __init__(self, vocab, totalUnigrams, unigrams, bigramKeys, bigramCounts, bigramTotals, trigramKeys, trigramCounts, contextKeys, contextTotals, logProbs=None):
+		self.vocab = vocab
+		self.totalUnigrams = totalUnigrams
+		self.unigrams = unigrams
+		self.bigramKeys = bigramKeys
+		self.bigramCounts = bigramCounts
+		self.bigramTotals = bigramTotals
+		self.trigramKeys = trigramKeys
+		self.trigramCounts = trigramCounts
+		self.contextKeys = contextKeys
+		self.contextTotals = contextTotals
+		self.unknownLogProb = log(1) - log(totalUnigrams)
+		if logProbs is None:
+			logProbs = self._computeLogProbs()
+		self.unigramLogProbs, self.bigramLogProbs, self.trigramLogProbs = logProbs
+
+	def _computeLogProbs(self):
+		logTotal = log(self.totalUnigrams)
+		unigramLogProbs = array.array("d", (log(count) - logTotal for count in self.unigrams))
+		bigramLogProbs = array.array("d", (log(count) - log(self.bigramTotals[key >> BITS]) for key, count in it.izip(self.bigramKeys, self.bigramCounts)))
+		trigramLogProbs = array.array("d", (log(count) - log(self.trigramTotal(key >> 2 * BITS, (key >> BITS) & (MAX_WORDS - 1))) for key, count in it.izip(self.trigramKeys, self.trigramCounts)))
+		return unigramLogProbs, bigramLogProbs, trigramLogProbs
+
+	def save(self, fileName):
+		"""
+		Writes the store to fileName as a single memory-mappable file
+		"""
+		sections = stringSections("vocab", list(self.vocab)) + [("total", "q", [self.totalUnigrams])]
+		for name, typecode, values in (("uni.cnt", "q", self.unigrams),
+				("bi.key", "q", self.bigramKeys), ("bi.cnt", "q", self.bigramCounts), ("bi.tot", "q", self.bigramTotals),
+				("tri.key", "q", self.trigramKeys), ("tri.cnt", "q", self.trigramCounts),
+				("ctx.key", "q", self.contextKeys), ("ctx.tot", "q", self.contextTotals)):
+			if values is not None:
+				sections.append((name, typecode, values))
+		for name, values in (("uni", self.unigramLogProbs), ("bi", self.bigramLogProbs), ("tri", self.trigramLogProbs)):
+			if isinstance(values, QuantizedArray):
+				sections += [(name + ".lpq", "B", values.codes), (name + ".cb", "f", values.codebook)]
+			else:
+				sections.append((name + ".lp", "d", values))
+		writeFile(fileName, MAGIC, VERSION, sections)
+
+	@staticmethod
+	def load(fileName):
+		"""
+		Maps a file written by save(). Nothing is parsed up front; lookups read the mapped arrays.
+		"""
+		f = BinaryFile(fileName, MAGIC)
+		if f.version > VERSION:
+			raise ValueError(fileName + " was written by a newer version (" + str(f.version) + ")")
+		def section(name):
+			return f.section(name) if name in f else None
+		def logProbs(name):
+			if name + ".lpq" in f:
+				return QuantizedArray(f.section(name + ".lpq"), array.array("f", f.section(name + ".cb")))
+			return f.section(name + ".lp")
+		return NgramStore(f.strings("vocab"), f.section("total")[0], section("uni.cnt"),
+			section("bi.key"), section("bi.cnt"), section("bi.tot"),
+			section("tri.key"), section("tri.cnt"),
+			section("ctx.key"), section("ctx.tot"),
+			(logProbs("uni"), logProbs("bi"), logProbs("tri")))
+
+	def quantize(self, levels=256):
+		"""
+		Returns a copy of the store whose log-probabilities are one-byte codes into a codebook of
+		at most levels values per order. It only keeps the keys and the log-probabilities:
+		it scores like the full store but has no counts (unigram(), bigram(), ...) to look up.
+		"""
+		logProbs = tuple(QuantizedArray.fromValues(values, levels) for values in (self.unigramLogProbs, self.bigramLogProbs, self.trigramLogProbs))
+		return NgramStore(self.vocab, self.totalUnigrams, None, self.bigramKeys, None, None, self.trigramKeys, None, None, None, logProbs)
+
+	def ngramCounts(self):
+		"""
+		Returns the number of (unigrams, bigrams, trigrams) in the store
+		"""
+		return len(self.vocab), len(self.bigramKeys), len(self.trigramKeys)
+
+	def memoryBytes(self):
+		"""
+		Approximate size of the store: its arrays and vocabulary. Mapped arrays count with their size in the file.
+		"""
+		total = _vocabBytes(self.vocab)
+		for values in (self.unigrams, self.bigramKeys, self.bigramCounts, self.bigramTotals, self.trigramKeys,
+				self.trigramCounts, self.contextKeys, self.contextTotals, self.unigramLogProbs, self.bigramLogProbs, self.trigramLogProbs):
+			if isinstance(values, QuantizedArray):
+				total += _arrayBytes(values.codes) + _arrayBytes(values.codebook)
+			elif values is not None:
+				total += _arrayBytes(values)
+		return total
+
+	@staticmethod
+	def isStoreFile(fileName):
+		return BinaryFile.isBinary(fileName, MAGIC)
+
+	@staticmethod
+	def fromFiles(unigram_file, bigram_file, trigram_file, cutoffs=None, vocabulary=None, workers=None):
+		"""
+		Reads the "token count", "count token1 token2" and "count token1 token2 token3" files,
+		plain or compressed, with workers processes (see NgramReader.readCounts).
+		cutoffs and vocabulary restrict what is kept, see NgramCounter.store.
+		"""
+		from NgramReader import readCounts
+		return readCounts(unigram_file, bigram_file, trigram_file, workers).store(cutoffs, vocabulary)
+
+	def wordId(self, word):
+		return self.vocab.index(word)
+
+	def unigramLogProb(self, w):
+		if w == UNKNOWN:
+			return self.unknownLogProb
+		return self.unigramLogProbs[w]
+
+	def bigramLogProb(self, w1, w2):
+		"""
+		Returns log P(w2|w1), or None if the bigram was never seen
+		"""
+		if w1 == UNKNOWN or w2 == UNKNOWN:
+			return None
+		i = _index(self.bigramKeys, packBigram(w1, w2))
+		return self.bigramLogProbs[i] if i >= 0 else None
+
+	def trigramLogProb(self, w1, w2, w3):
+		"""
+		Returns log P(w3|w1 w2), or None if the trigram was never seen
+		"""
+		if w1 == UNKNOWN or w2 == UNKNOWN or w3 == UNKNOWN:
+			return None
+		i = _index(self.trigramKeys, packTrigram(w1, w2, w3))
+		return self.trigramLogProbs[i] if i >= 0 else None
+
+	def unigram(self, w):
+		if w == UNKNOWN:
+			return 1
+		return self.unigrams[w]
+
+	def bigram(self, w1, w2):
+		if w1 == UNKNOWN or w2 == UNKNOWN:
+			return 0
+		return _find(self.bigramKeys, self.bigramCounts, packBigram(w1, w2))
+
+	def bigramTotal(self, w1):
+		if w1 == UNKNOWN:
+			return 0
+		return self.bigramTotals[w1]
+
+	def trigram(self, w1, w2, w3):
+		if w1 == UNKNOWN or w2 == UNKNOWN or w3 == UNKNOWN:
+			return 0
+		return _find(self.trigramKeys, self.trigramCounts, packTrigram(w1, w2, w3))
+
+	def trigramTotal(self, w1, w2):
+		if w1 == UNKNOWN or w2 == UNKNOWN:
+			return 0
+		return _find(self.contextKeys, self.contextTotals, packBigram(w1, w2))
+
+	def view(self, name):
+		"""
+		Returns the array attribute name as a NumPy array sharing memory with the store (needs numpy)
+		"""
+		views = self.__dict__.setdefault("_views", {})
+		if name not in views:
+			views[name] = _asNumpy(getattr(self, name))
+		return views[name]
+
+	def bigramsAfter(self, w1):
+		"""
+		Returns (ids, logProbs) as NumPy arrays for every bigram starting with w1, sorted by id
+		"""
+		if w1 == UNKNOWN:
+			return None
+		return self._following("bigramKeys", "bigramLogProbs", packBigram(w1, 0), packBigram(w1 + 1, 0))
+
+	def trigramsAfter(self, w1, w2):
+		"""
+		Returns (ids, logProbs) as NumPy arrays for every trigram starting with w1 w2, sorted by id
+		"""
+		if w1 == UNKNOWN or w2 == UNKNOWN:
+			return None
+		return self._following("trigramKeys", "trigramLogProbs", packTrigram(w1, w2, 0), packTrigram(w1, w2 + 1, 0))
+
+	def _following(self, keyName, logProbName, first, last):
+		keys = self.view(keyName)
+		lo, hi = keys.searchsorted([first, last])
+		return keys[lo:hi] & (MAX_WORDS - 1), self.view(logProbName)[lo:hi]
+
+class NgramCounter:
+	"""
+	Accumulates n-gram counts while the files are read. Words get provisional ids in order of
+	appearance and n-grams are counted under packed keys, so no per n-gram tuples or strings are kept;
+	store() renumbers everything into the sorted vocabulary of an NgramStore.
+	"""
+	def __init__(self):
+		self.vocab = Vocabulary()
+		self.unigramCounts = collections.defaultdict(int)
+		self.bigramCounts = collections.defaultdict(int)
+		self.trigramCounts = collections.defaultdict(int)
+
+	def addUnigram(self, token, count):
+		self.unigramCounts[self.vocab.id(token)] += count
+
+	def addBigram(self, token1, token2, count):
+		wordId = self.vocab.id
+		self.bigramCounts[packBigram(wordId(token1), wordId(token2))] += count
+
+	def addTrigram(self, token1, token2, token3, count):
+		wordId = self.vocab.id
+		self.trigramCounts[packTrigram(wordId(token1), wordId(token2), wordId(token3))] += count
+
+	def store(self, cutoffs=None, vocabulary=None):
+		"""
+		Returns the counts as an NgramStore.
+			cutoffs:     (unigram, bigram, trigram) minimum counts; rarer n-grams are left out
+			vocabulary:  a set of words; n-grams with a word outside it are left out
+		Totals are taken over all the counts that were read, so the n-grams that are kept score
+		exactly as in the full store and the ones left out fall back to lower orders.
+		"""
+		minUnigram, minBigram, minTrigram = cutoffs or (1, 1, 1)
+		allowed = None
+		if vocabulary is not None:
+			allowed = [word in vocabulary for word in self.vocab.words]
+		keptUnigrams = _keep(self.unigramCounts, minUnigram, allowed, 1)
+		keptBigrams = _keep(self.bigramCounts, minBigram, allowed, 2)
+		keptTrigrams = _keep(self.trigramCounts, minTrigram, allowed, 3)
+		mask = MAX_WORDS - 1
+
+		used = set(keptUnigrams)
+		for key in keptBigrams:
+			used.add(key >> BITS)
+			used.add(key & mask)
+		for key in keptTrigrams:
+			used.add(key >> 2 * BITS)
+			used.add((key >> BITS) & mask)
+			used.add(key & mask)
+		if len(used) > MAX_WORDS:
+			raise ValueError("Too many words for the n-gram store: %d (at most %d)" % (len(used), MAX_WORDS))
+		vocab = SortedWords(self.vocab.word(w) for w in used)
+		remap = [UNKNOWN] * len(self.vocab)
+		for newId, word in enumerate(vocab):
+			remap[self.vocab.get(word)] = newId
+		del used
+
+		unigrams = array.array("l", [1]) * len(vocab)
+		for w, count in keptUnigrams.iteritems():
+			unigrams[remap[w]] += count
+		totalUnigrams = sum(self.unigramCounts.itervalues()) + len(self.unigramCounts)
+
+		bigramKeys = array.array("l", sorted(packBigram(remap[key >> BITS], remap[key & mask]) for key in keptBigrams))
+		bigramCounts = array.array("l", [0]) * len(bigramKeys)
+		for key, count in keptBigrams.iteritems():
+			bigramCounts[bisect.bisect_left(bigramKeys, packBigram(remap[key >> BITS], remap[key & mask]))] = count
+		bigramTotals = array.array("l", [0]) * len(vocab)
+		for key, count in self.bigramCounts.iteritems():
+			w1 = remap[key >> BITS]
+			if w1 != UNKNOWN:
+				bigramTotals[w1] += count
+
+		trigramKeys = array.array("l", sorted(packTrigram(remap[key >> 2 * BITS], remap[(key >> BITS) & mask], remap[key & mask]) for key in keptTrigrams))
+		trigramCounts = array.array("l", [0]) * len(trigramKeys)
+		contexts = {}
+		for key, count in keptTrigrams.iteritems():
+			context = packBigram(remap[key >> 2 * BITS], remap[(key >> BITS) & mask])
+			trigramCounts[bisect.bisect_left(trigramKeys, (context << BITS) | remap[key & mask])] = count
+			contexts[key >> BITS] = context
+		contextTotals = collections.defaultdict(int)
+		for key, count in self.trigramCounts.iteritems():
+			context = contexts.get(key >> BITS)
+			if context is not None:
+				contextTotals[context] += count
+		contextKeys = array.array("l", sorted(contextTotals))
+		contextTotals = array.array("l", (contextTotals[key] for key in contextKeys))
+
+		return NgramStore(vocab, totalUnigrams, unigrams, bigramKeys, bigramCounts, bigramTotals,
+			trigramKeys, trigramCounts, contextKeys, contextTotals)
+
+def _keep(counts, minimum, allowed, order):
+	"""
+	Returns the entries of counts (packed keys of order words) that pass the cutoff and the vocabulary
+	"""
+	if minimum <= 1 and allowed is None:
+		return counts
+	mask = MAX_WORDS - 1
+	kept = {}
+	for key, count in counts.iteritems():
+		if count < minimum:
+			continue
+		if allowed is not None and not all(allowed[(key >> (i * BITS)) & mask] for i in xrange(order)):
+			continue
+		kept[key] = count
+	return kept
+
+def _arrayBytes(values):
+	if isinstance(values, MappedArray):
+		return len(values) * values.item.size
+	return len(values) * values.itemsize
+
+def _vocabBytes(vocab):
+	if isinstance(vocab, SortedWords):
+		return sys.getsizeof(vocab.words) + sum(sys.getsizeof(word) for word in vocab.words)
+	return _arrayBytes(vocab.offsets) + len(vocab.blob)
+
+def _asNumpy(values):
+	import numpy as np
+	if isinstance(values, QuantizedArray):
+		return _QuantizedView(_asNumpy(values.codes), _asNumpy(values.codebook).astype(np.float64))
+	if isinstance(values, MappedArray):
+		return np.frombuffer(values.buf, dtype="<" + values.typecode, count=len(values), offset=values.offset)
+	return np.frombuffer(values, dtype=values.typecode)
+
+class _QuantizedView:
+	"""
+	NumPy counterpart of a QuantizedArray: indexing returns the decoded values
+	"""
+	def __init__(self, codes, codebook):
+		self.codes = codes
+		self.codebook = codebook
+
+	def __getitem__(self, index):
+		return self.codebook[self.codes[index]]
+
+def _index(keys, key):
+	if hasattr(keys, "find"):
+		return keys.find(key)
+	i = bisect.bisect_left(keys, key)
+	if i < len(keys) and keys[i] == key:
+		return i
+	return -1
+
+def _find(keys, values, key):
+	i = _index(keys, key)
+	return values[i] if i >= 0 else 0
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+#Multi-process EM engine for IBM Model One Training
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+from SparseEM import SparseEM
+
+#Occurrence arrays of the engine and views of its shared memory. They are set right before the
+#worker pool is forked, so every worker inherits them instead of receiving a pickled copy.
+_snapshot = None
+
+def _shardCounts(shard):
+	"""
+	Runs in a worker, or in the parent with a single shard. E-step of the occurrences of shard
+	(index, start, end), which start and end on sentence boundaries: writes the expected count of
+	every pair into row index of the shared counts and returns the shard's log-likelihood
+	(without the constant alignment term)
+	"""
+	index, start, end = shard
+	occ_pair, occ_group, group_tokens, t, counts = _snapshot
+	pairs = occ_pair[start:end]
+	if not len(pairs):
+		counts[index] = 0.0
+		return 0.0
+	#the shard's sentences own a contiguous range of groups
+	groups = occ_group[start:end]
+	first = groups.min()
+	groups = groups - first
+	n_groups = groups.max() + 1
+	occ_t = t[pairs]
+	total_s = np.bincount(groups, weights=occ_t, minlength=n_groups)
+	counts[index] = np.bincount(pairs, weights=occ_t / total_s[groups], minlength=counts.shape[1])
+	tokens = group_tokens[first:first + n_groups]
+	return float(np.dot(tokens, np.log(total_s / tokens)))
+
+class ParallelEM(SparseEM):
+	"""
+	EM engine that runs the E-step of SparseEM in a process pool.
+	The occurrences of the bitext are split into one shard per worker along sentence boundaries.
+	t(f|e) and one row of expected counts per shard live in shared memory: every iteration the
+	parent copies t in, each worker fills its shard's row of flat counts indexed by pair id,
+	and the parent sums the rows with numpy and runs the M-step. The pool is forked once and
+	kept until close(). Gives the same model as the other engines (needs numpy).
+	"""
+	def __init__(self, foreign_lines, native_lines, workers=None):
+		SparseEM.__init__(self, foreign_lines, native_lines)
+		self.workers = workers or multiprocessing.cpu_count()
+		n_pairs = len(self.pair_native)
+		#split the occurrences into shards of about the same size, at sentence starts
+		n_occurrences = int(self.occ_starts[-1])
+		bounds = np.unique(self.occ_starts[np.searchsorted(self.occ_starts, np.linspace(0, n_occurrences, self.workers + 1))])
+		self.shards = [(index, int(start), int(end)) for index, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]))] or [(0, 0, 0)]
+		self.sharedT = np.frombuffer(RawArray("d", max(n_pairs, 1)), dtype=np.float64)[:n_pairs]
+		self.sharedCounts = np.frombuffer(RawArray("d", max(len(self.shards) * n_pairs, 1)), dtype=np.float64)[:len(self.shards) * n_pairs].reshape(len(self.shards), n_pairs)
+		self.pool = None
+
+	def iterate(self):
+		"""
+		Runs one iteration, returns (logLikelihood, words, maxChange) like DictEM.iterate
+		"""
+		if self.t is None:
+			return SparseEM.iterate(self)
+		self.sharedT[:] = self.t
+		logLikelihood = sum(self._mapShards()) - self.alignment_log
+		counts = self.sharedCounts.sum(axis=0)
+		native_total = np.bincount(self.pair_native, weights=counts, minlength=len(self.native_vocab))
+		t = counts / native_total[self.pair_native]
+		maxChange = float(np.abs(t - self.t).max()) if len(t) else 0.0
+		self.t = t
+		return logLikelihood, self.words, maxChange
+
+	def _mapShards(self):
+		"""
+		Runs _shardCounts over every shard, in the pool when there is more than one
+		"""
+		global _snapshot
+		_snapshot = (self.occ_pair, self.occ_group, self.group_tokens, self.sharedT, self.sharedCounts)
+		if len(self.shards) == 1:
+			return [_shardCounts(self.shards[0])]
+		if self.pool is None:
+			self.pool = multiprocessing.Pool(min(self.workers, len(self.shards)))
+		return self.pool.map(_shardCounts, self.shards, chunksize=1)
+
+	def close(self):
+		"""
+		Stops the worker pool
+		"""
+		global _snapshot
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+			self.pool = None
+		_snapshot = None
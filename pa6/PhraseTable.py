@@ -5,9 +5,14 @@ import itertools as it
 import collections
 import math
 import codecs
+import heapq
 from ModelOne import ModelOne,getDict
+from Corpus import openCorpus
+from Tokenizer import VOCAB
 from itertools import izip
 
+TABLE_LIMIT = 20 #Translations of a foreign phrase the decoder considers
+
 def getCounter():
 	return collections.Counter()
 
@@ -17,33 +22,52 @@ class PhraseTable:
 
 	1. Gets a bitext from foreign_file and native_file.
 	2. Parses and saves aligned sentences.
+
+	Phrases are stored as tuples of VOCAB ids, so pt[tuple(VOCAB.lookupSentence(["la", "casa"]))] returns
+	a Counter of native phrase id tuples. top_translations takes and returns tuples of words.
 	"""
-	def __init__(self, foreign_file, native_file, Verbose=False):
+	def __init__(self, foreign_file, native_file, Verbose=False, corpusDir=None, models=None):
+		"""
+		corpusDir: if set, the bitext is tokenized into memory-mapped corpus files in this directory
+			and phrase extraction streams over them instead of keeping every sentence in memory.
+		models: optional BidirectionalModelOne trained on the same bitext, used instead of loading
+			english-spanish.model and spanish-english.model
+		"""
 		self.foreign_sentences = []
 		self.native_sentences = []
 		self.phrase_dict = collections.defaultdict(getCounter)
-		self.reverse_phrase_dict = collection.defaultdict(getCounter)
+		self.reverse_phrase_dict = collections.defaultdict(getCounter)
 
 		self.phrase_counts = collections.defaultdict(lambda: collections.defaultdict(lambda: 0.0))
+		self.top_translations_cache = {}
 
-		self.fore_to_nat_model = ModelOne(loadFile="english-spanish.model")#rows are span
-		self.nat_to_fore_model = ModelOne(loadFile="spanish-english.model")#rows are engl
+		if models:
+			self.fore_to_nat_model = models.reverse#rows are span
+			self.nat_to_fore_model = models.forward#rows are engl
+		else:
+			self.fore_to_nat_model = ModelOne(loadFile="english-spanish.model")#rows are span
+			self.nat_to_fore_model = ModelOne(loadFile="spanish-english.model")#rows are engl
 		
-		with open(foreign_file) as f:
-			for line in f:
-				line_tokenized = self.fore_to_nat_model.processSentence(line)
-				self.foreign_sentences.append(line_tokenized)
-		with open(native_file) as f:
-			for line in f:
-				line_tokenized = self.nat_to_fore_model.processSentence(line)
-				self.native_sentences.append(line_tokenized)
+		if corpusDir:
+			self.foreign_sentences = openCorpus(foreign_file, corpusDir, self.fore_to_nat_model.processSentence)
+			self.native_sentences = openCorpus(native_file, corpusDir, self.nat_to_fore_model.processSentence)
+		else:
+			with open(foreign_file) as f:
+				for line in f:
+					line_tokenized = self.fore_to_nat_model.processSentence(line)
+					self.foreign_sentences.append(line_tokenized)
+			with open(native_file) as f:
+				for line in f:
+					line_tokenized = self.nat_to_fore_model.processSentence(line)
+					self.native_sentences.append(line_tokenized)
 		
 		for fsentence, nsentence in izip(self.foreign_sentences, self.native_sentences):
 			if len(fsentence) != 0 and len(nsentence) != 0:
 				fore_to_nat_alignments = self.build_alignments(self.fore_to_nat_model, fsentence, nsentence)
 				nat_to_fore_alignments = self.build_alignments(self.nat_to_fore_model, nsentence, fsentence)
 				phrase_align_table = self.build_phrase_align_table(fore_to_nat_alignments, nat_to_fore_alignments)
-				self.extract_phrases(phrase_align_table, fsentence, nsentence)
+				#the models are keyed on words, the phrases on ids
+				self.extract_phrases(phrase_align_table, VOCAB.internSentence(fsentence), VOCAB.internSentence(nsentence))
 
 		self.normalize_table()
 		print self.phrase_dict
@@ -66,6 +90,38 @@ class PhraseTable:
 	def __getitem__(self, index):
 		return self.reverse_phrase_dict[index]
 
+	def __contains__(self, index):
+		return index in self.reverse_phrase_dict
+
+	def top_translations(self, foreign_phrase, k=TABLE_LIMIT, language_model=None):
+		"""
+		Returns the k best (native_phrase, translation log-prob, language model log-prob) of foreign_phrase, best first.
+		foreign_phrase and the native phrases are tuples of words.
+		The language model log-prob is that of the native phrase alone (0.0 without a language_model);
+		phrases are ranked by the sum of both. Results are kept, so every phrase is scored once.
+		"""
+		key = (foreign_phrase, k, language_model)
+		top = self.top_translations_cache.get(key)
+		if top is None:
+			foreign_ids = tuple(VOCAB.lookupSentence(foreign_phrase))
+			if foreign_ids not in self.reverse_phrase_dict:
+				return []
+			words = VOCAB.words
+			scored = []
+			for native_ids, prob in self.reverse_phrase_dict[foreign_ids].iteritems():
+				native_phrase = tuple(words[w] for w in native_ids)
+				scored.append((native_phrase, prob, language_model.score(list(native_phrase)) if language_model else 0.0))
+			top = heapq.nlargest(k, scored, key=lambda option: option[1] + option[2])
+			self.top_translations_cache[key] = top
+		return top
+
+	def native_words(self):
+		"""
+		Returns the set of native words used by any phrase in the table, e.g. to restrict the language model vocabulary
+		"""
+		native_ids = set(word_id for native_phrases in self.reverse_phrase_dict.itervalues() for native_phrase in native_phrases for word_id in native_phrase)
+		return set(VOCAB.words[word_id] for word_id in native_ids)
+
 	def reverse_phrase_align_table(self,phrase_align_table):
 		reverse_table = collections.defaultdict(lambda:set([]))
 		for native_index,alignments in phrase_align_table.iteritems():
@@ -90,15 +146,15 @@ class PhraseTable:
 			if curr_phrase_head[0] - 1 == prev_phrase_tail[0] and curr_phrase_head[1] - 1 == prev_phrase_tail[1]:
 				pair_one = self.phrase_to_word(prev_phrase, fsentence, nsentence, prev_phrase_isHorizontal)
 				pair_two = self.phrase_to_word(phrase, fsentence, nsentence, isHorizontal)
-				native_string = pair_one[0] + " " + pair_two[0]
-				fore_string = pair_one[1] + " " + pair_two[1]
+				native_string = pair_one[0] + pair_two[0]
+				fore_string = pair_one[1] + pair_two[1]
 				#update map
 				self.phrase_counts[native_string][fore_string] += 1.0
 			elif curr_phrase_head[0] - 1 == prev_phrase_tail[0] and curr_phrase_head[1] + 1 == prev_phrase_tail[1]:
 				pair_one = self.phrase_to_word(phrase, fsentence, nsentence, isHorizontal)
 				pair_two = self.phrase_to_word(prev_phrase, fsentence, nsentence, isHorizontal)
-				native_string = pair_two[0] + " " + pair_one[0]
-				fore_string = pair_one[1] + " " + pair_two[1]
+				native_string = pair_two[0] + pair_one[0]
+				fore_string = pair_one[1] + pair_two[1]
 				#update map
 				self.phrase_counts[native_string][fore_string] += 1.0
 			#updates
@@ -138,17 +194,16 @@ class PhraseTable:
 		return -1
 
 	def phrase_to_word(self, phrase, fsentence, nsentence, isHorizontal):
+		"""
+		Returns the (native_phrase, foreign_phrase) of phrase as tuples of the ids in nsentence and fsentence
+		"""
 		if isHorizontal:
-			native_phrase = nsentence[phrase[0][0]]
-			fore_phrase = ""
-			for alignment in phrase:
-				fore_phrase += (fsentence[alignment[1]] + " ")
+			native_phrase = (nsentence[phrase[0][0]],)
+			fore_phrase = tuple(fsentence[alignment[1]] for alignment in phrase)
 		else:
-			fore_phrase = fsentence[phrase[0][1]]
-			native_phrase = ""
-			for alignment in phrase:
-				native_phrase += (nsentence[alignment[0]] + " ")
-		return (native_phrase.strip(), fore_phrase.strip())
+			fore_phrase = (fsentence[phrase[0][1]],)
+			native_phrase = tuple(nsentence[alignment[0]] for alignment in phrase)
+		return (native_phrase, fore_phrase)
 	
 	def get_contained_phrases(self, phrase_align_table, isFlipped):
 		phrase_list = []
@@ -179,8 +234,9 @@ class PhraseTable:
 		for i,fword in enumerate(foreign_sentence):
 			max_score = float('-inf')
 			best_trans= "" #best nword for current fword
+			row = model[fword]
 			for j,nword in enumerate(native_sentence):
-				curr_score = model[fword][nword]
+				curr_score = row[nword]
 				if curr_score>max_score:
 					max_score = curr_score
 					best_trans = nword
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+#Pruning and compact storage of IBM Model One translation tables
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+import sys
+import math
+import array
+import bisect
+import getopt
+import collections
+from ModelFile import MappedTable
+from BinaryFile import SortedWords
+
+STORAGE_TYPES = ("float32", "uint8")
+TIE_TOLERANCE = 1e-5 #Log-probs closer than this are tied, e.g. after rounding to float32
+
+def getCounter():
+	return collections.Counter()
+
+def pruneTable(probabilityMap, threshold=None, topK=None, cumulativeMass=None):
+	"""
+	Prunes t(f|e) one native word e at a time and returns (probabilityMap, reverseMap) as
+	defaultdicts of Counters. Within a row, entries are kept best first while all of these hold:
+		threshold:       t(f|e) >= threshold
+		topK:            at most topK entries
+		cumulativeMass:  the entries kept before this one hold less than cumulativeMass of the row
+	The best entry of every row is always kept. Values stay log-probabilities.
+	"""
+	logThreshold = math.log(threshold) if threshold else None
+	newMap = collections.defaultdict(getCounter)
+	reverseMap = collections.defaultdict(getCounter)
+	for native_w, foreign_dict in probabilityMap.iteritems():
+		mass = 0.0
+		for rank, (foreign_w, value) in enumerate(sorted(foreign_dict.iteritems(), key=lambda item: item[1], reverse=True)):
+			if rank > 0:
+				if logThreshold is not None and value < logThreshold:
+					break
+				if topK is not None and rank >= topK:
+					break
+				if cumulativeMass is not None and mass >= cumulativeMass:
+					break
+			mass += math.exp(value)
+			newMap[native_w][foreign_w] = value
+			reverseMap[foreign_w][native_w] = value
+	return newMap, reverseMap
+
+def compactTable(table, storage="float32"):
+	"""
+	Returns table as a MappedTable over in-memory arrays: sorted row and column vocabularies,
+	row offsets, column ids and either float32 log-probabilities or 8-bit codes into a codebook.
+	"""
+	if storage not in STORAGE_TYPES:
+		raise ValueError("Unknown storage type: " + str(storage))
+	row_vocab = SortedWords(table.iterkeys())
+	col_vocab = SortedWords(col_w for row_w, row in table.iteritems() for col_w in row)
+	offsets = array.array("L", [0])
+	cols = array.array("I")
+	values = array.array("f")
+	for row_w in row_vocab:
+		for col_id, value in sorted((col_vocab.index(w), v) for w, v in table[row_w].iteritems()):
+			cols.append(col_id)
+			values.append(value)
+		offsets.append(len(cols))
+	if storage == "uint8":
+		values = QuantizedArray.fromValues(values)
+	return MappedTable(row_vocab, col_vocab, offsets, cols, values)
+
+class QuantizedArray:
+	"""
+	Read-only array of floats stored as one byte each. The codebook holds the mean value of
+	up to 256 equally populated bins, so the frequent values get the finest resolution.
+	Equal values always share a bin, so a value that fills a bin on its own is stored exactly.
+	"""
+	def __init__(self, codes, codebook):
+		self.codes = codes
+		self.codebook = codebook
+
+	@staticmethod
+	def fromValues(values, levels=256):
+		ordered = sorted(values)
+		bounds = []
+		codebook = array.array("f")
+		start = 0
+		while start < len(ordered):
+			size = -(-(len(ordered) - start) // (levels - len(bounds)))
+			end = bisect.bisect_right(ordered, ordered[start + size - 1], start + size - 1)
+			bounds.append(ordered[end - 1])
+			codebook.append(sum(ordered[start:end]) / (end - start))
+			start = end
+		codes = array.array("B", (min(bisect.bisect_left(bounds, value), len(bounds) - 1) for value in values))
+		return QuantizedArray(codes, codebook)
+
+	def __len__(self):
+		return len(self.codes)
+
+	def __getitem__(self, index):
+		codebook = self.codebook
+		if isinstance(index, slice):
+			return [codebook[code] for code in self.codes[index]]
+		return codebook[self.codes[index]]
+
+	def __iter__(self):
+		codebook = self.codebook
+		for code in self.codes:
+			yield codebook[code]
+
+def tableEntries(table):
+	return sum(len(row) for row_w, row in table.iteritems())
+
+def tableBytes(table):
+	"""
+	Approximate memory held by a translation table, including the strings of its row and column
+	words. For array-backed tables the rows decoded so far are counted too, and file-backed parts
+	count with their mapped size.
+	"""
+	if hasattr(table, "row_vocab"):
+		values = table.values
+		parts = [table.offsets, table.cols] + ([values.codes, values.codebook] if hasattr(values, "codebook") else [values])
+		total = sum(_partBytes(part) for part in parts) + _vocabBytes(table.row_vocab) + _vocabBytes(table.col_vocab)
+		#rows decoded by lookups so far
+		return total + _rowBytes(table.rows)
+	col_words = set(col_w for row_w, row in table.iteritems() for col_w in row)
+	return _rowBytes(table) + sum(sys.getsizeof(word) for word in table.iterkeys()) + sum(sys.getsizeof(word) for word in col_words)
+
+def _rowBytes(rows):
+	total = sys.getsizeof(rows)
+	for row_w, row in rows.iteritems():
+		total += sys.getsizeof(row) + sys.getsizeof(0.0) * len(row)
+	return total
+
+def _partBytes(part):
+	if isinstance(part, array.array):
+		return sys.getsizeof(part)
+	return len(part) * part.item.size
+
+def _vocabBytes(vocab):
+	if hasattr(vocab, "words"):
+		return sys.getsizeof(vocab.words) + sum(sys.getsizeof(word) for word in vocab.words)
+	return _partBytes(vocab.offsets) + len(vocab.blob)
+
+def pruningReport(before, after, foreign_words, k=10):
+	"""
+	Compares two ModelOnes on the candidate lookups the translator makes for foreign_words.
+	Returns a dictionary with entry counts and memory of both reverse tables, the fraction of words
+	whose best candidate is unchanged, and the average overlap of the top-k candidate lists.
+	The best candidate counts as unchanged when it was tied best before (within TIE_TOLERANCE),
+	so reordered ties are not reported as changes.
+	"""
+	sameBest = 0
+	overlap = 0.0
+	words = 0
+	for foreign_w in set(foreign_words):
+		if foreign_w not in before.reverseMap:
+			continue
+		oldRow = before.reverseMap[foreign_w]
+		oldBest = oldRow.most_common(k)
+		old = [native_w for native_w, value in oldBest]
+		new = [native_w for native_w, value in after.reverseMap[foreign_w].most_common(k)] if foreign_w in after.reverseMap else []
+		words += 1
+		if new and new[0] in oldRow:
+			sameBest += oldRow[new[0]] >= oldBest[0][1] - TIE_TOLERANCE
+		overlap += float(len(set(old) & set(new))) / len(old)
+	return {
+		"entriesBefore": tableEntries(before.reverseMap),
+		"entriesAfter": tableEntries(after.reverseMap),
+		"bytesBefore": tableBytes(before.probabilityMap) + tableBytes(before.reverseMap),
+		"bytesAfter": tableBytes(after.probabilityMap) + tableBytes(after.reverseMap),
+		"wordsCompared": words,
+		"sameBest": float(sameBest) / words if words else 1.0,
+		"topKOverlap": overlap / words if words else 1.0,
+	}
+
+def printReport(report):
+	print "Entries:            %d -> %d" % (report["entriesBefore"], report["entriesAfter"])
+	print "Memory:             %.1f MB -> %.1f MB" % (report["bytesBefore"] / 1048576.0, report["bytesAfter"] / 1048576.0)
+	print "Words compared:     %d" % report["wordsCompared"]
+	print "Same best:          %.2f%%" % (100.0 * report["sameBest"])
+	print "Top-k overlap:      %.2f%%" % (100.0 * report["topKOverlap"])
+
+######FOR TESTING PURPOSES ONLY########
+def main(argv):
+	"""
+	Usage: Pruning.py -l model [-t threshold] [-k topK] [-m mass] [-q float32|uint8] [-s sentences] [-o output]
+	"""
+	from ModelOne import ModelOne
+	from Tokenizer import tokenize
+	opts, args = getopt.getopt(argv, "l:t:k:m:q:s:o:")
+	opts = dict(opts)
+	#compare against the tables as training leaves them: nested Counters
+	model = ModelOne(loadFile=opts["-l"])
+	model.probabilityMap, model.reverseMap = pruneTable(model.probabilityMap)
+	pruned = ModelOne(loadFile=opts["-l"])
+	pruned.prune(float(opts["-t"]) if "-t" in opts else None, int(opts["-k"]) if "-k" in opts else None, float(opts["-m"]) if "-m" in opts else None)
+	if "-q" in opts:
+		pruned.compact(opts["-q"])
+	words = []
+	if "-s" in opts:
+		with open(opts["-s"]) as f:
+			for line in f:
+				words.extend(tokenize(line))
+	printReport(pruningReport(model, pruned, words))
+	if "-o" in opts:
+		pruned.saveToFile(opts["-o"])
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+#Vectorized EM engine for IBM Model One Training
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+import itertools as it
+import collections
+import numpy as np
+
+class SparseEM:
+	"""
+	Drop-in replacement for the dictionary EM loop in ModelOne.
+
+	Words are mapped to integer ids and t(f|e) is stored as one float array with an entry for
+	every (native word, foreign word) pair that co-occurs somewhere in the bitext.
+	Every sentence pair is flattened once into "occurrences", one per (native token, foreign token)
+	combination, each pointing at its pair in the t array and at its (sentence, foreign word) group.
+	An EM step is then:
+		E-step: gather t for every occurrence, segment-sum it per group, divide
+		M-step: segment-sum the posteriors per pair and per native word, divide
+	which gives the same table as ModelOne's dictionary loop.
+	"""
+	def __init__(self, foreign_lines, native_lines):
+		self.native_vocab = []
+		self.foreign_vocab = []
+		self.t = None
+		self._buildOccurrences(foreign_lines, native_lines)
+
+	def _buildOccurrences(self, foreign_lines, native_lines):
+		native_ids = collections.defaultdict(lambda: len(native_ids))
+		foreign_ids = collections.defaultdict(lambda: len(foreign_ids))
+		occurrences = []
+		native_lengths = []
+		for s, (foreign_s, native_s) in enumerate(it.izip(foreign_lines, native_lines)):
+			if not foreign_s or not native_s:
+				continue
+			f = np.array([foreign_ids[w] for w in foreign_s], dtype=np.int64)
+			e = np.array([native_ids[w] for w in native_s], dtype=np.int64)
+			occurrences.append((s, np.repeat(e, len(f)), np.tile(f, len(e))))
+			native_lengths.append((s, len(e)))
+		self.native_vocab = [None] * len(native_ids)
+		for w, i in native_ids.iteritems():
+			self.native_vocab[i] = w
+		self.foreign_vocab = [None] * len(foreign_ids)
+		for w, i in foreign_ids.iteritems():
+			self.foreign_vocab[i] = w
+
+		n_foreign = max(len(foreign_ids), 1)
+		if occurrences:
+			occ_native = np.concatenate([e for s, e, f in occurrences])
+			occ_foreign = np.concatenate([f for s, e, f in occurrences])
+			occ_sentence = np.concatenate([np.full(len(f), s, dtype=np.int64) for s, e, f in occurrences])
+		else:
+			occ_native = occ_foreign = occ_sentence = np.zeros(0, dtype=np.int64)
+		#offset of the first occurrence of every kept sentence, and the total at the end
+		self.occ_starts = np.cumsum([0] + [len(f) for s, e, f in occurrences])
+
+		#unique co-occurring pairs, and the pair every occurrence belongs to
+		pairs, occ_pair = np.unique(occ_native * n_foreign + occ_foreign, return_inverse=True)
+		self.pair_native = (pairs // n_foreign).astype(np.int32)
+		self.pair_foreign = (pairs % n_foreign).astype(np.int32)
+		self.occ_pair = occ_pair.astype(np.int32)
+		#groups of occurrences sharing a denominator total_s[foreign_w]
+		groups, occ_group = np.unique(occ_sentence * n_foreign + occ_foreign, return_inverse=True)
+		self.occ_group = occ_group.astype(np.int32)
+		self.n_groups = len(groups)
+		#foreign tokens per group and the constant alignment term, for the log-likelihood
+		native_len = np.ones(len(occurrences) and occurrences[-1][0] + 1, dtype=np.float64)
+		for s, length in native_lengths:
+			native_len[s] = length
+		self.group_tokens = np.bincount(self.occ_group, minlength=self.n_groups) / native_len[groups // n_foreign]
+		self.words = int(round(self.group_tokens.sum()))
+		self.alignment_log = float(np.dot(self.group_tokens, np.log(native_len[groups // n_foreign])))
+
+	def iterate(self):
+		"""
+		Runs one iteration, returns (logLikelihood, words, maxChange) like DictEM.iterate
+		"""
+		if self.t is None:
+			#initialize t(f|e) uniformly / first iteration
+			counts = np.bincount(self.occ_pair, minlength=len(self.pair_native)).astype(np.float64)
+			native_total = np.bincount(self.pair_native, weights=counts, minlength=len(self.native_vocab))
+			self.t = counts / native_total[self.pair_native]
+			return None, 0, None
+		occ_t = self.t[self.occ_pair]
+		total_s = np.bincount(self.occ_group, weights=occ_t, minlength=self.n_groups)
+		counts = np.bincount(self.occ_pair, weights=occ_t / total_s[self.occ_group], minlength=len(self.pair_native))
+		native_total = np.bincount(self.pair_native, weights=counts, minlength=len(self.native_vocab))
+		t = counts / native_total[self.pair_native]
+		#every token of a group has the same sum over native words: total_s / group_tokens
+		logLikelihood = float(np.dot(self.group_tokens, np.log(total_s / self.group_tokens))) - self.alignment_log
+		maxChange = float(np.abs(t - self.t).max()) if len(t) else 0.0
+		self.t = t
+		return logLikelihood, self.words, maxChange
+
+	def setTable(self, table):
+		"""
+		Warm-starts the engine from a previous t(f|e). Pairs that are not in table (e.g. from newly
+		added sentences) keep their co-occurrence initialization, then every row is renormalized.
+		"""
+		self.t = None
+		self.iterate()
+		t = self.t.tolist()
+		for i, (e, f) in enumerate(it.izip(self.pair_native.tolist(), self.pair_foreign.tolist())):
+			t[i] = table.get(self.native_vocab[e], {}).get(self.foreign_vocab[f], t[i])
+		t = np.array(t)
+		native_total = np.bincount(self.pair_native, weights=t, minlength=len(self.native_vocab))
+		self.t = t / native_total[self.pair_native]
+
+	def table(self):
+		"""
+		Returns t(f|e) as a map that can be indexed [native_word][foreign_word]
+		"""
+		if self.t is None:
+			self.iterate()
+		initMap = collections.defaultdict(dict)
+		for e, f, value in it.izip(self.pair_native.tolist(), self.pair_foreign.tolist(), self.t.tolist()):
+			initMap[self.native_vocab[e]][self.foreign_vocab[f]] = value
+		return initMap
+
+	def close(self):
+		"""
+		Releases the engine's resources, nothing to do here
+		"""
+		pass
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#Shared tokenizer and vocabulary interning
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+import re
+
+NUMBERS = r'(\d[\d\.\,\%]*[ .]\%? ?)|( \d[\d\.\,\%]*)'
+PUNCTUATION = r'(&.*?;)|( ?[\.\,\:\?])|¿\ | \-|\- '
+CLEANUP = re.compile(NUMBERS + '|' + PUNCTUATION)
+
+def tokenize(line):
+	"""
+	Line should be a string.
+	Lowercases it, removes numbers and punctuation and returns a list of words.
+	"""
+	return CLEANUP.sub("", line.lower().strip()).split()
+
+def tokenizeBatch(lines):
+	"""
+	Tokenizes an iterable of lines, yielding the list of words of each line as it is read
+	"""
+	sub = CLEANUP.sub
+	for line in lines:
+		yield sub("", line.lower().strip()).split()
+
+class Vocabulary:
+	"""
+	Interns tokens as dense ints: the first token seen gets 0, the next new one 1, and so on.
+	id() adds unknown tokens, get() only looks them up.
+	"""
+	def __init__(self):
+		self.ids = {}
+		self.words = []
+
+	def id(self, word):
+		word_id = self.ids.get(word)
+		if word_id is None:
+			word_id = len(self.words)
+			self.ids[word] = word_id
+			self.words.append(word)
+		return word_id
+
+	def get(self, word, default=-1):
+		return self.ids.get(word, default)
+
+	def word(self, word_id):
+		return self.words[word_id]
+
+	def internSentence(self, words):
+		"""
+		Returns the list of ids of words, adding new ones to the vocabulary
+		"""
+		ids = self.ids
+		return [ids[w] if w in ids else self.id(w) for w in words]
+
+	def lookupSentence(self, words):
+		"""
+		Returns the list of ids of words, with -1 for the unknown ones
+		"""
+		get = self.ids.get
+		return [get(w, -1) for w in words]
+
+	def __len__(self):
+		return len(self.words)
+
+	def __contains__(self, word):
+		return word in self.ids
+
+#Process-wide vocabulary of ModelOne's interned training lines (ModelOne(intern=True)) and of the
+#phrases of PhraseTable. The LanguageModel numbers words in its own NgramStore.
+VOCAB = Vocabulary()
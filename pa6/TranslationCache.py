@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+#Memoization of translations of full sentences and of source spans
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+import os
+import hashlib
+import threading
+import collections
+import cPickle as pickle
+
+CACHE_SIZE = 10000          # sentences kept by default
+SPAN_CACHE_SIZE = 100000    # spans kept by default
+
+def modelVersion(fileNames, **options):
+	"""
+	Returns a short string identifying a set of model files (by name, size and modification time)
+	and options such as the number of candidates. Translations cached under another version are not reused.
+	"""
+	h = hashlib.md5()
+	for fileName in fileNames:
+		if fileName and os.path.exists(fileName):
+			info = os.stat(fileName)
+			h.update("%s:%d:%d;" % (os.path.abspath(fileName), info.st_size, int(info.st_mtime)))
+		else:
+			h.update("%s;" % fileName)
+	for key in sorted(options):
+		h.update("%s=%r;" % (key, options[key]))
+	return h.hexdigest()[:16]
+
+class _LRU:
+	"""
+	Dictionary keeping at most maxSize entries, dropping the least recently used one first
+	"""
+	def __init__(self, maxSize):
+		self.maxSize = maxSize
+		self.entries = collections.OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		value = self.entries.pop(key, None)
+		if value is None:
+			self.misses += 1
+			return None
+		self.entries[key] = value
+		self.hits += 1
+		return value
+
+	def put(self, key, value):
+		self.entries.pop(key, None)
+		self.entries[key] = value
+		while len(self.entries) > self.maxSize:
+			self.entries.popitem(last=False)
+
+	def clear(self):
+		self.entries.clear()
+
+	def stats(self):
+		lookups = self.hits + self.misses
+		return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+			"hitRate": float(self.hits) / lookups if lookups else 0.0}
+
+class TranslationCache:
+	"""
+	LRU caches of translations, safe to share between threads:
+		sentences: normalized source sentence (its words joined by spaces) -> translation
+		spans:     tuple of source words -> whatever the decoder computed for that span (spanSize 0 turns it off)
+	Everything is tied to a model version (see modelVersion); setVersion with another version
+	empties the caches. With fileName, entries of the same version are loaded from it and save()
+	writes them back, so repeated runs over overlapping data skip what they have already translated.
+	"""
+	def __init__(self, version, maxSize=CACHE_SIZE, spanSize=SPAN_CACHE_SIZE, fileName=None):
+		self.version = version
+		self.sentences = _LRU(maxSize)
+		self.spans = _LRU(spanSize) if spanSize else None
+		self.fileName = fileName
+		self.lock = threading.Lock()
+		if fileName and os.path.exists(fileName):
+			self.load(fileName)
+
+	@staticmethod
+	def key(foreign_s):
+		"""
+		Normalized key of a sentence given as a list of words or a string
+		"""
+		if isinstance(foreign_s, basestring):
+			foreign_s = foreign_s.lower().split()
+		return " ".join(foreign_s)
+
+	def get(self, foreign_s):
+		"""
+		Returns the cached translation of foreign_s, or None
+		"""
+		with self.lock:
+			return self.sentences.get(TranslationCache.key(foreign_s))
+
+	def put(self, foreign_s, translation):
+		with self.lock:
+			self.sentences.put(TranslationCache.key(foreign_s), translation)
+
+	def getSpan(self, span):
+		if self.spans is None:
+			return None
+		with self.lock:
+			return self.spans.get(tuple(span))
+
+	def putSpan(self, span, value):
+		if self.spans is None:
+			return
+		with self.lock:
+			self.spans.put(tuple(span), value)
+
+	def setVersion(self, version):
+		"""
+		Switches to another model version, dropping everything cached under the current one
+		"""
+		with self.lock:
+			if version != self.version:
+				self.version = version
+				self.sentences.clear()
+				if self.spans is not None:
+					self.spans.clear()
+
+	def stats(self):
+		with self.lock:
+			stats = {"version": self.version, "sentences": self.sentences.stats()}
+			if self.spans is not None:
+				stats["spans"] = self.spans.stats()
+			return stats
+
+	def save(self, fileName=None):
+		"""
+		Atomically replaces fileName (default: the file given to the constructor) with the cached entries
+		"""
+		fileName = fileName or self.fileName
+		with self.lock:
+			contents = [self.version, self.sentences.entries.items(), self.spans.entries.items() if self.spans is not None else []]
+			tmpName = fileName + ".tmp"
+			with open(tmpName, "wb") as f:
+				pickle.dump(contents, f, protocol=pickle.HIGHEST_PROTOCOL)
+			os.rename(tmpName, fileName)
+
+	def load(self, fileName):
+		"""
+		Adds the entries saved in fileName, unless they were saved under another model version
+		"""
+		with open(fileName, "rb") as f:
+			version, sentences, spans = pickle.load(f)
+		if version != self.version:
+			return False
+		with self.lock:
+			for key, value in sentences:
+				self.sentences.put(key, value)
+			if self.spans is not None:
+				for key, value in spans:
+					self.spans.put(key, value)
+		return True
+
+def formatStats(stats):
+	"""
+	One line summary of TranslationCache.stats()
+	"""
+	parts = []
+	for name in ("sentences", "spans"):
+		if name in stats:
+			s = stats[name]
+			parts.append("%s: %d entries, %d hits, %d misses (%.1f%% hit rate)" % (name, s["entries"], s["hits"], s["misses"], 100.0 * s["hitRate"]))
+	return "; ".join(parts)
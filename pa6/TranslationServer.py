@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+#Resident translation server (localhost HTTP or Unix socket) and its client
+#Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
+
+import os
+import sys
+import json
+import time
+import Queue
+import socket
+import getopt
+import httplib
+import logging
+import threading
+import collections
+import SocketServer
+import BaseHTTPServer
+from Translator import loadModels, translationVersion, translateSentence, translationPool, translateInWorker, cachedTranslations, fillTranslations
+from TranslationCache import TranslationCache
+
+MAX_BATCH = 64              # sentences translated together at most
+MAX_WAIT = 0.005            # seconds a batch waits for more requests once it has one
+LATENCY_WINDOW = 1000       # requests the latency percentiles are computed over
+
+class _Request:
+	"""
+	Sentences waiting to be translated, and the event set once their translations (or error) are in
+	"""
+	def __init__(self, sentences):
+		self.sentences = sentences
+		self.translations = None
+		self.error = None
+		self.received = time.time()
+		self.done = threading.Event()
+
+class TranslationServer:
+	"""
+	Keeps a ModelOne and a LanguageModel loaded and translates the sentences it is sent.
+	Requests go into a queue; a single batching thread takes whatever has arrived within
+	maxWait seconds (up to maxBatch sentences) and translates it as one micro-batch, in a
+	process pool sharing the models when workers > 1. Counters of requests, batches, latency and
+	throughput are kept for stats().
+
+	serveHttp(port) and serveUnix(path) expose it with the same JSON requests:
+		{"sentences": ["una frase", ...]} or {"sentence": "una frase"}  ->  {"translations": [...]}
+		{"stats": true}                                                 ->  the stats() dictionary
+	over HTTP as POST /translate and GET /stats, over a Unix socket as one JSON object per line.
+	"""
+	def __init__(self, model, langModel, workers=1, maxBatch=MAX_BATCH, maxWait=MAX_WAIT, cache=None):
+		self.model = model
+		self.cache = cache
+		self.langModel = langModel
+		self.workers = workers
+		self.maxBatch = maxBatch
+		self.maxWait = maxWait
+		self.queue = Queue.Queue()
+		self.pool = translationPool(model, langModel, workers) if workers > 1 else None
+		self.lock = threading.Lock()
+		self.started = time.time()
+		self.requests = 0
+		self.sentences = 0
+		self.batches = 0
+		self.errors = 0
+		self.busy = 0.0		# seconds spent translating
+		self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+		self.batcher = threading.Thread(target=self._batchLoop, name="batcher")
+		self.batcher.daemon = True
+		self.batcher.start()
+
+	def translate(self, sentences):
+		"""
+		Translates a list of sentences (strings) and returns the list of translations. Thread safe;
+		requests made at the same time are batched together.
+		"""
+		sentences = [sentence.lower().strip().split() for sentence in sentences]
+		translations = cachedTranslations(self.cache, sentences)
+		misses = [foreign_s for foreign_s, translation in zip(sentences, translations) if translation is None]
+		if misses:
+			request = _Request(misses)
+			self.queue.put(request)
+			request.done.wait()
+			if request.error is not None:
+				raise request.error
+			fillTranslations(self.cache, sentences, translations, request.translations)
+		return translations
+
+	def stats(self):
+		with self.lock:
+			latencies = sorted(self.latencies)
+			uptime = time.time() - self.started
+			return {
+				"uptime": uptime,
+				"requests": self.requests,
+				"sentences": self.sentences,
+				"batches": self.batches,
+				"errors": self.errors,
+				"meanBatchSize": float(self.sentences) / self.batches if self.batches else 0.0,
+				"sentencesPerSecond": self.sentences / self.busy if self.busy else 0.0,
+				"latencyMean": sum(latencies) / len(latencies) if latencies else 0.0,
+				"latencyP50": _percentile(latencies, 0.5),
+				"latencyP95": _percentile(latencies, 0.95),
+				"latencyMax": latencies[-1] if latencies else 0.0,
+				"cache": self.cache.stats() if self.cache is not None else None,
+			}
+
+	def handle(self, message):
+		"""
+		Answers one decoded JSON request
+		"""
+		if message.get("stats"):
+			return self.stats()
+		if "sentence" in message:
+			sentences = [message["sentence"]]
+		else:
+			sentences = message["sentences"]
+		return {"translations": self.translate([_bytes(sentence) for sentence in sentences])}
+
+	def close(self):
+		self.queue.put(None)
+		self.batcher.join()
+		if self.pool is not None:
+			self.pool.close()
+			self.pool.join()
+
+	def _batchLoop(self):
+		while True:
+			request = self.queue.get()
+			if request is None:
+				return
+			batch = [request]
+			size = len(request.sentences)
+			deadline = time.time() + self.maxWait
+			while size < self.maxBatch:
+				remaining = deadline - time.time()
+				if remaining <= 0:
+					break
+				try:
+					request = self.queue.get(timeout=remaining)
+				except Queue.Empty:
+					break
+				if request is None:
+					self.queue.put(None)
+					break
+				batch.append(request)
+				size += len(request.sentences)
+			self._translateBatch(batch)
+
+	def _translateBatch(self, batch):
+		start = time.time()
+		sentences = [foreign_s for request in batch for foreign_s in request.sentences]
+		error = None
+		try:
+			if self.pool is not None:
+				translations = self.pool.map(translateInWorker, sentences, chunksize=max(1, len(sentences) / self.workers))
+			else:
+				translations = [translateSentence(foreign_s, self.model, self.langModel) for foreign_s in sentences]
+		except Exception, e:
+			logging.exception("Translation failed")
+			error = e
+		end = time.time()
+		with self.lock:
+			self.batches += 1
+			self.busy += end - start
+			for request in batch:
+				self.requests += 1
+				if error is None:
+					self.sentences += len(request.sentences)
+				else:
+					self.errors += 1
+				self.latencies.append(end - request.received)
+		position = 0
+		for request in batch:
+			if error is None:
+				request.translations = [translation.strip() for translation in translations[position:position + len(request.sentences)]]
+			request.error = error
+			position += len(request.sentences)
+			request.done.set()
+
+	def serveHttp(self, port, host="127.0.0.1"):
+		server = _ThreadingHTTPServer((host, port), _HttpHandler)
+		server.translationServer = self
+		logging.info("Serving on http://%s:%d", host, port)
+		server.serve_forever()
+
+	def serveUnix(self, path):
+		if os.path.exists(path):
+			os.remove(path)
+		server = SocketServer.ThreadingUnixStreamServer(path, _UnixHandler)
+		server.daemon_threads = True
+		server.translationServer = self
+		logging.info("Serving on unix socket %s", path)
+		try:
+			server.serve_forever()
+		finally:
+			os.remove(path)
+
+def _percentile(ordered, fraction):
+	if not ordered:
+		return 0.0
+	return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def _bytes(sentence):
+	return sentence.encode("utf-8") if isinstance(sentence, unicode) else sentence
+
+class _ThreadingHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+class _HttpHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	def do_GET(self):
+		if self.path == "/stats":
+			self._reply(200, self.server.translationServer.stats())
+		else:
+			self._reply(404, {"error": "unknown path " + self.path})
+
+	def do_POST(self):
+		if self.path != "/translate":
+			self._reply(404, {"error": "unknown path " + self.path})
+			return
+		try:
+			message = json.loads(self.rfile.read(int(self.headers.getheader("Content-Length", 0))))
+			self._reply(200, self.server.translationServer.handle(message))
+		except (ValueError, KeyError, TypeError), e:
+			self._reply(400, {"error": str(e)})
+		except Exception, e:
+			self._reply(500, {"error": str(e)})
+
+	def _reply(self, status, body):
+		data = json.dumps(body)
+		self.send_response(status)
+		self.send_header("Content-Type", "application/json")
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, format, *args):
+		logging.debug(format, *args)
+
+class _UnixHandler(SocketServer.StreamRequestHandler):
+	def handle(self):
+		for line in iter(self.rfile.readline, ""):
+			if not line.strip():
+				continue
+			try:
+				reply = self.server.translationServer.handle(json.loads(line))
+			except Exception, e:
+				reply = {"error": str(e)}
+			self.wfile.write(json.dumps(reply) + "\n")
+			self.wfile.flush()
+
+class TranslationClient:
+	"""
+	Client of a TranslationServer. address is "http://host:port" or the path of a Unix socket.
+	"""
+	def __init__(self, address):
+		self.address = address
+		self.connection = None
+
+	def translate(self, sentences):
+		"""
+		Returns the translations of a list of sentences
+		"""
+		return self._request({"sentences": sentences})["translations"]
+
+	def stats(self):
+		return self._request({"stats": True})
+
+	def _request(self, message):
+		if self.address.startswith("http://"):
+			reply = self._requestHttp(message)
+		else:
+			reply = self._requestUnix(message)
+		if "error" in reply:
+			raise RuntimeError("Translation server error: " + reply["error"])
+		return reply
+
+	def _requestHttp(self, message):
+		connection = httplib.HTTPConnection(self.address[len("http://"):].rstrip("/"))
+		try:
+			if message.get("stats"):
+				connection.request("GET", "/stats")
+			else:
+				connection.request("POST", "/translate", json.dumps(message), {"Content-Type": "application/json"})
+			return json.loads(connection.getresponse().read())
+		finally:
+			connection.close()
+
+	def _requestUnix(self, message):
+		if self.connection is None:
+			sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+			sock.connect(self.address)
+			self.connection = sock.makefile("rw")
+			sock.close()
+		self.connection.write(json.dumps(message) + "\n")
+		self.connection.flush()
+		return json.loads(self.connection.readline())
+
+	def close(self):
+		if self.connection is not None:
+			self.connection.close()
+			self.connection = None
+
+######FOR TESTING PURPOSES ONLY########
+def main(argv):
+	"""
+	Server: TranslationServer.py [-l model] [-f foreign -n native] [-g lm.bin] [-k candidates] [-w workers] (-p port | -u socket)
+	Client: TranslationServer.py -c address [-s sentences] [--stats]
+		translates the lines of the -s file (stdin by default) through the server at address
+	"""
+	opts, args = getopt.getopt(argv, "l:f:n:g:k:w:p:u:c:s:", ["stats"])
+	opts = dict(opts)
+	if "-c" in opts:
+		client = TranslationClient(opts["-c"])
+		if "--stats" in opts:
+			print json.dumps(client.stats(), indent=1, sort_keys=True)
+			return
+		f = open(opts["-s"]) if "-s" in opts else sys.stdin
+		for line in iter(f.readline, ""):
+			print client.translate([line])[0].encode("utf-8")
+			sys.stdout.flush()
+		client.close()
+		return
+	modelArgs = (opts.get("-l", "../pa6/save.model"), opts.get("-f"), opts.get("-n"), opts.get("-g"), int(opts["-k"]) if "-k" in opts else None)
+	model, langModel = loadModels(*modelArgs)
+	cache = TranslationCache(translationVersion(*modelArgs), spanSize=0)
+	server = TranslationServer(model, langModel, int(opts.get("-w", 1)), cache=cache)
+	if "-u" in opts:
+		server.serveUnix(opts["-u"])
+	else:
+		server.serveHttp(int(opts.get("-p", 8080)))
+
+if __name__ == '__main__':
+	logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
+	main(sys.argv[1:])
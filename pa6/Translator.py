@@ -1,41 +1,198 @@
 #!/usr/bin/env python
 #Translation script for Machine Learning
 #Tian Wang, Bogac Kerem Goksel, Russell Kaplan, Duc Nguyen
-from os import system
-
-from ModelOne import ModelOne, getDict
+from ModelOne import ModelOne, getDict, CANDIDATE_COUNT
 from LanguageModel import LanguageModel
+from TranslationCache import TranslationCache, modelVersion, formatStats
 import itertools as it
 import collections
 import math
 import sys
+import time
 import getopt
+import logging
+import multiprocessing
+
+PROGRESS_EVERY = 100        # sentences between two progress messages
+BATCH_SIZE = 32             # sentences read and translated together when streaming
+
+def translateSentence(foreign_s, model, langModel):
+	"""
+	Greedy word by word translation of foreign_s (a list of words), returns it as a string
+	"""
+	currentSentence = ""
+	state = LanguageModel.START
+	for word in foreign_s:
+		candidates = model.candidates(word)
+		if candidates:
+			scores = langModel.score_batch(state, [candidate_w[0] for candidate_w in candidates])
+			scores += [candidate_w[1] for candidate_w in candidates]
+			bestWord = candidates[scores.argmax()][0]
+			currentSentence += (bestWord + " ")
+			state = langModel.score_next(state, bestWord)[1]
+		else: 
+			currentSentence += (word + " ")
+			state = langModel.score_next(state, word)[1]
+	return currentSentence
+
+#The models used by the translation workers. They are set right before the pool is forked,
+#so every worker shares them copy-on-write instead of receiving a pickled copy.
+_models = None
 
-def translateSentences(sentences, model, langModel=None):
-	outputSentences = []
-	it = 0
-	for foreign_s in sentences:
-		if it%100==0:
-			system("say " + str(it))
-		currentSentence = ""
-		for word in foreign_s:
-			candidates = model.reverseMap[word].most_common(50)
-			if candidates:
-				bestWord = ""
-				bestScore = float('-inf')
-				for candidate_w in candidates:
-					w_score = candidate_w[1] + langModel.score((currentSentence + candidate_w[0]).split())
-					if w_score > bestScore:
-						bestWord = candidate_w[0]
-						bestScore = w_score
-				currentSentence += (bestWord + " ")
-			else: 
-				currentSentence += (word + " ")
-		print currentSentence
-		it+=1
+def translateInWorker(foreign_s):
+	model, langModel = _models
+	return translateSentence(foreign_s, model, langModel)
 
+def translationPool(model, langModel, workers):
+	"""
+	Returns a process pool whose workers translate with model and langModel: map translateInWorker
+	over lists of words on it
+	"""
+	global _models
+	_models = (model, langModel)
+	return multiprocessing.Pool(workers)
+
+def translateSentences(sentences, model, langModel=None, workers=1, cache=None):
+	"""
+	Translates a list of sentences (lists of words) and returns the translations in the same order.
+	With more than one worker the sentences are spread over a process pool that shares
+	model and langModel. Sentences found in cache (a TranslationCache) are not translated again.
+	Progress and the final speed are logged.
+	"""
+	global _models
+	start = time.time()
+	outputSentences = cachedTranslations(cache, sentences)
+	misses = [foreign_s for foreign_s, translation in it.izip(sentences, outputSentences) if translation is None]
+	if workers > 1 and misses:
+		pool = translationPool(model, langModel, workers)
+		translations = pool.imap(translateInWorker, misses, chunksize=max(1, min(PROGRESS_EVERY, len(misses) / (4 * workers))))
+	else:
+		pool = None
+		translations = (translateSentence(foreign_s, model, langModel) for foreign_s in misses)
+	try:
+		translations = _progress(translations, len(misses))
+		fillTranslations(cache, sentences, outputSentences, translations)
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+			_models = None
+	_logSpeed(len(outputSentences), time.time() - start, workers, cache)
 	return outputSentences
 
+def translateStream(lines, model, langModel, out, workers=1, batchSize=BATCH_SIZE, cache=None):
+	"""
+	Translates lines (any iterable of strings, e.g. a file or sys.stdin) while they are read and
+	writes every translation to out, in input order, as soon as it is ready.
+	Lines are read in micro-batches of batchSize. With more than one worker a batch is translated
+	by the process pool while the previous one is written out; at most two batches are in flight,
+	so memory does not grow with the input. Sentences found in cache are not translated again.
+	Returns the number of sentences translated.
+	"""
+	global _models
+	start = time.time()
+	count = 0
+	sentences = (line.lower().strip().split() for line in lines)
+	batches = iter(lambda: list(it.islice(sentences, batchSize)), [])
+	if workers > 1:
+		pool = translationPool(model, langModel, workers)
+		pending = collections.deque()
+		try:
+			for batch in batches:
+				cached = cachedTranslations(cache, batch)
+				misses = [foreign_s for foreign_s, translation in it.izip(batch, cached) if translation is None]
+				pending.append((batch, cached, pool.map_async(translateInWorker, misses, chunksize=max(1, len(misses) / workers))))
+				if len(pending) > 1:
+					count = _writeTranslations(out, fillTranslations(cache, *_wait(pending.popleft())), count)
+			while pending:
+				count = _writeTranslations(out, fillTranslations(cache, *_wait(pending.popleft())), count)
+		finally:
+			pool.close()
+			pool.join()
+			_models = None
+	else:
+		for batch in batches:
+			for foreign_s in batch:
+				translation = cache.get(foreign_s) if cache is not None else None
+				if translation is None:
+					translation = translateSentence(foreign_s, model, langModel)
+					if cache is not None:
+						cache.put(foreign_s, translation)
+				count = _writeTranslations(out, [translation], count)
+	_logSpeed(count, time.time() - start, workers, cache)
+	return count
+
+def cachedTranslations(cache, sentences):
+	"""
+	Returns the cached translation of every sentence, None for the ones that are not cached
+	"""
+	if cache is None:
+		return [None] * len(sentences)
+	return [cache.get(foreign_s) for foreign_s in sentences]
+
+def fillTranslations(cache, sentences, cached, translations):
+	"""
+	Puts translations, in order, where cached has None, adds them to cache, and returns cached
+	"""
+	translations = iter(translations)
+	for i, foreign_s in enumerate(sentences):
+		if cached[i] is None:
+			cached[i] = next(translations)
+			if cache is not None:
+				cache.put(foreign_s, cached[i])
+	return cached
+
+def _wait(entry):
+	batch, cached, result = entry
+	return batch, cached, result.get()
+
+def _progress(translations, total):
+	for translated, translation in enumerate(translations, 1):
+		if translated % PROGRESS_EVERY == 0:
+			logging.info("Translated %d/%d sentences", translated, total)
+		yield translation
+
+def _logSpeed(count, elapsed, workers, cache):
+	logging.info("Translated %d sentences in %.1fs (%.1f sentences/sec, %d worker%s)", count, elapsed,
+		count / elapsed if elapsed > 0 else 0.0, workers, "s" if workers > 1 else "")
+	if cache is not None:
+		logging.info("Cache %s", formatStats(cache.stats()))
+
+def _writeTranslations(out, translations, count):
+	for translation in translations:
+		out.write(translation + "\n")
+	out.flush()
+	if (count + len(translations)) / PROGRESS_EVERY > count / PROGRESS_EVERY:
+		logging.info("Translated %d sentences", count + len(translations))
+	return count + len(translations)
+
+def loadModels(loadFile, foreignFile=None, nativeFile=None, ngramFile=None, candidateCount=None):
+	"""
+	Returns the (ModelOne, LanguageModel) to translate with: the model is trained on foreignFile and
+	nativeFile if both are given, loaded from loadFile otherwise; the language model is the compiled
+	ngramFile if given, trained from the default n-gram files otherwise
+	"""
+	if foreignFile and nativeFile:
+		model = ModelOne(foreignFile, nativeFile)
+	else:
+		model = ModelOne(loadFile=loadFile)
+	if model.candidateIndex is None or (candidateCount and candidateCount != model.candidateIndex.k):
+		logging.warning("The model has no candidate index with k = %d, building it (save the model with that candidateCount to skip this)", candidateCount or CANDIDATE_COUNT)
+		model.buildCandidateIndex(candidateCount or CANDIDATE_COUNT)
+
+	if ngramFile:
+		langModel = LanguageModel(binary_file=ngramFile)
+	else:
+		langModel = LanguageModel()
+	return model, langModel
+
+def translationVersion(loadFile, foreignFile=None, nativeFile=None, ngramFile=None, candidateCount=None):
+	"""
+	Model version (see TranslationCache.modelVersion) of the models loadModels returns for the same arguments
+	"""
+	files = [foreignFile, nativeFile] if foreignFile and nativeFile else [loadFile]
+	files += [ngramFile] if ngramFile else ["../pa6/ngrams/1.txt", "../pa6/ngrams/2.txt", "../pa6/ngrams/3.txt"]
+	return modelVersion(files, candidates=candidateCount or CANDIDATE_COUNT, decoder="greedy")
 
 def main(argv):
 	sentencesFile = "../pa6/es-en/dev/newstest2012.es"
@@ -43,9 +200,14 @@ def main(argv):
 	nativeFile = None
 	loadFile = "../pa6/save.model"
 	ngramFile = None
+	candidateCount = None
+	workers = 1
+	outputFile = None
+	batchSize = BATCH_SIZE
+	cacheFile = None
 
 	try:
-		opts, args = getopt.getopt(argv, "is:f:n:l:g:")
+		opts, args = getopt.getopt(argv, "is:f:n:l:g:k:w:o:b:c:")
 	except getopt.GetoptError:
 		print 'Wrong argument. Use -i for improved version'
 		sys.exit(2)
@@ -65,6 +227,16 @@ def main(argv):
 			loadFile = value
 		elif opt == '-g':
 			ngramFile = value
+		elif opt == '-k':
+			candidateCount = int(value)
+		elif opt == '-w':
+			workers = int(value)
+		elif opt == '-o':
+			outputFile = value
+		elif opt == '-b':
+			batchSize = int(value)
+		elif opt == '-c':
+			cacheFile = value
 
 	# print "improved!" if isImproved else "Not improved!"
 	# print sentencesFile
@@ -72,22 +244,24 @@ def main(argv):
 	# print nativeFile
 	# print loadFile
 
-	if foreignFile and nativeFile:
-		model = ModelOne(foreignFile, nativeFile)
-	else:
-		model = ModelOne(loadFile=loadFile)
-
-	langModel = LanguageModel()
+	model, langModel = loadModels(loadFile, foreignFile, nativeFile, ngramFile, candidateCount)
+	#repeated sentences are translated once; with -c the cache is kept in cacheFile between runs
+	cache = TranslationCache(translationVersion(loadFile, foreignFile, nativeFile, ngramFile, candidateCount), spanSize=0, fileName=cacheFile)
 
+	#sentences are streamed from the file, or from stdin with -s -, to stdout or the -o file
 	if sentencesFile:
-		sentences = []
-		with open(sentencesFile) as f:
-			for line in f:
-				sentences.append(line.lower().strip().split())
-		translated = translateSentences(sentences, model, langModel)
-		# for sentence in translated:
-		# 	print sentence
-
+		f = sys.stdin if sentencesFile == "-" else open(sentencesFile)
+		out = open(outputFile, "w") if outputFile else sys.stdout
+		try:
+			translateStream(iter(f.readline, ""), model, langModel, out, workers, batchSize, cache)
+		finally:
+			if cacheFile:
+				cache.save()
+			if f is not sys.stdin:
+				f.close()
+			if out is not sys.stdout:
+				out.close()
 
 if __name__=='__main__':
+	logging.basicConfig(format="%(asctime)s %(message)s", level=logging.INFO)
 	main(sys.argv[1:])
\ No newline at end of file
@@ -64,7 +64,7 @@ def bleu_for_one(ref, evl):
 
 if __name__ == '__main__':
 	if len(sys.argv) < 3:
-		print "Usage: %s reference_file your_output_file" % (__file__)
+		print "Usage: %s reference_file your_output_file (- for stdin)" % (__file__)
 		sys.exit(0)
 
 	ref_filename = sys.argv[1]
@@ -74,12 +74,13 @@ if __name__ == '__main__':
 		print "Reference file '%s' does not exist." % (ref_filename)
 		sys.exit(0)
 
-	if not op.exists(eval_filename):
+	#"-" reads the output from stdin, e.g. piped from Translator.py
+	if eval_filename != "-" and not op.exists(eval_filename):
 		print "Output file '%s' does not exist." % (eval_filename)
 		sys.exit(0)
 
 	with open(ref_filename) as f_ref:
-		with open(eval_filename) as f_eval:
+		with (sys.stdin if eval_filename == "-" else open(eval_filename)) as f_eval:
 			n_sent = 0
 			bleu1 = 0.0
 			bleu2 = 0.0
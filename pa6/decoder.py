@@ -1,254 +1,389 @@
 # -*- coding: utf-8 -*-
 #!/usr/bin/env python
-#Implementation of IBM Model One Training
+#Phrase-based stack decoder
 
 import itertools as it
-import collections
 import math
-import codecs
+import time
 import heapq
-import nltk
-import ModelOne
-from itertools import izip
 from LanguageModel import LanguageModel
-from PhraseTable import PhraseTable
+from PhraseTable import PhraseTable, TABLE_LIMIT
+from bleu_score import bleu_for_one
+from TranslationCache import modelVersion
 
-MAX_STACK_LEN = 5
+MAX_STACK_LEN = 5 #Hypotheses kept per stack (histogram pruning)
+BEAM_THRESHOLD = 10.0 #Hypotheses costing this much more than the best one of their stack are dropped (threshold pruning)
 DISTORTION_CONSTANT = 0.1
+LOG_DISTORTION = math.log(DISTORTION_CONSTANT)
+DISTORTION_LIMIT = 6 #Longest jump |ai − bi−1 − 1| allowed between consecutive foreign phrases, None for no limit
+REORDERING_WINDOW = None #A phrase must end fewer than this many words after the first uncovered foreign word, None for no limit
+MAX_PHRASE_LEN = 7 #Longest foreign phrase translated at once
+UNKNOWN_WORD_PROB = 0.0 #Translation log-prob of a foreign word missing from the phrase table, which is copied through untranslated
 
 class HypoStack:
     """
-    Is a priority queue of hypotheses
+    Is a bounded stack of the hypotheses covering the same number of foreign words.
+    Histogram pruning keeps at most max_len hypotheses, threshold pruning drops those whose cost is
+    more than beam above the cheapest one seen.
+    Entries are kept in a heap on -cost, so the worst hypothesis is on top: inserting and evicting it
+    are O(log n). A hypothesis replaced through recombination is flagged as removed and skipped;
+    the heap is rebuilt without them once they outnumber the live ones.
     """
-    def __init__(self):
-        self.pq = []                         # list of entries arranged in a heap
-        self.entry_finder = {}               # mapping of tasks to entries
-        self.REMOVED = '<removed-elem>'      # placeholder for a removed task
+    def __init__(self, max_len=MAX_STACK_LEN, beam=BEAM_THRESHOLD):
+        self.pq = []                         # list of [-cost, count, hypothesis] entries arranged in a heap
+        self.entry_finder = {}               # mapping of hypotheses to entries
+        self.REMOVED = '<removed-elem>'      # placeholder for a removed hypothesis
         self.nFlaggedForRemoval = 0
+        self.counter = it.count()            # tie-breaker between entries of the same cost
+        self.max_len = max_len
+        self.beam = beam
+        self.best_cost = float('inf')
+        self.recombination = {}              # (coverage, lm_state, fp_end) -> cheapest hypothesis added with that key
 
     def __len__(self):
         return len(self.pq) - self.nFlaggedForRemoval
 
     def __iter__(self):
         for entry in self.pq:
-            if entry[-1] != self.REMOVED:
+            if entry[-1] is not self.REMOVED:
                 yield entry[-1]
 
     def add(self, elem, priority=0):
-        'Add a new elem or update the priority of an existing elem'
-        if elem in self.entry_finder:
-            remove_elem(elem)
-        entry = [priority, elem]
+        'Add a new elem with cost priority'
+        entry = [-priority, next(self.counter), elem]
         self.entry_finder[elem] = entry
         heapq.heappush(self.pq, entry)
 
     def remove(self, elem):
-        'Mark an existing task as REMOVED.  Raise KeyError if not found.'
+        'Mark an existing hypothesis as REMOVED.  Raise KeyError if not found.'
         entry = self.entry_finder.pop(elem)
         entry[-1] = self.REMOVED
         self.nFlaggedForRemoval += 1
-
-    def pop(self):
-        'Remove and return the lowest priority task. Raise KeyError if empty.'
-        while self.pq:
-            priority, elem = heapq.heappop(self.pq)
-            if elem is not self.REMOVED:
-                del self.entry_finder[elem]
-                return elem
-            else:
-                self.nFlaggedForRemoval -= 1
-        raise KeyError('pop from an empty priority queue')
+        if self.nFlaggedForRemoval > len(self.entry_finder):
+            self.pq = [entry for entry in self.pq if entry[-1] is not self.REMOVED]
+            heapq.heapify(self.pq)
+            self.nFlaggedForRemoval = 0
+
+    def worst(self):
+        'Return the entry of the most expensive hypothesis. Raise IndexError if empty.'
+        while self.pq[0][-1] is self.REMOVED:
+            heapq.heappop(self.pq)
+            self.nFlaggedForRemoval -= 1
+        return self.pq[0]
 
     def remove_worst(self):
-        self.remove(heapq.nlargest(1, self.pq)[0][-1])
-
+        elem = self.worst()[-1]
+        heapq.heappop(self.pq)
+        del self.entry_finder[elem]
+        return elem
 
+    def push(self, hyp):
+        """
+        Adds hyp unless it is pruned. With recombination: hypotheses with the same coverage, language
+        model state and last foreign word are extended the same way from here on, so only the cheapest
+        one is kept. Returns False if hyp was dropped.
+        """
+        if hyp.cost > self.best_cost + self.beam:
+            return False
+        key = (hyp.coverage, hyp.lm_state, hyp.fp_end)
+        other = self.recombination.get(key)
+        if other is not None:
+            if other.cost <= hyp.cost:
+                return False
+            if other in self.entry_finder:
+                self.remove(other)
+        if len(self) >= self.max_len:
+            if -self.worst()[0] <= hyp.cost:
+                return False
+            self.remove_worst()
+        self.recombination[key] = hyp
+        self.add(hyp, hyp.cost)
+        self.best_cost = min(self.best_cost, hyp.cost)
+        return True
+
+    def hypotheses(self):
+        """
+        Returns the hypotheses left after pruning, cheapest first
+        """
+        limit = self.best_cost + self.beam
+        return sorted((hyp for hyp in self if hyp.cost <= limit), key=lambda hyp: hyp.cost)
 
 
-class Hypothesis:
+class Hypothesis(object):
     """
-    Represents a hypothesis with cost, words translated so far, and marks of which words
-    have been covered.
+    Represents a hypothesis with cost, the last english phrase and marks of which words
+    have been covered. The rest of the translation is reached through prev_hyp.
     """
-    def __init__(self, english_phrase, covering, fp_start, fp_end, prev_hyp, ht, lm, pt):
+    __slots__ = ('english_phrase', 'coverage', 'fp_start', 'fp_end', 'prev_hyp', 'lm_state', 'score', 'cost')
+
+    def __init__(self, english_phrase, coverage, fp_start, fp_end, prev_hyp, lm_state, score, cost):
         self.english_phrase = english_phrase #The english phrase associated with this foreign_phrase(just the last one)
-        self.covering = covering #The complete list of foreign words covered by this hypothesis
-        self.cost = compute_cost(ht, lm, pt) #Search cost of this hypothesis
-        self.prev_hyp = prev_hyp #Its previous hypothesis in the search tree
-        self.total = prev_hyp.total + 1 if prev_hyp.total else 1 #What is this variable? Should have commented.
-        self.fp_start = fp_start # The index of the firs word of the foreign phrase this hypothesis covers
+        self.coverage = coverage #Bitmask of the foreign words covered by this hypothesis: bit i is set once word i is translated
+        self.fp_start = fp_start # The index of the first word of the foreign phrase this hypothesis covers
         self.fp_end = fp_end # The index of the last word of the foreign phrase this hypothesis covers
+        self.prev_hyp = prev_hyp #Its previous hypothesis in the search tree
+        self.lm_state = lm_state #Language model state after the english words so far
+        self.score = score #Log-prob of the translation so far: translation, language model and distortion
+        self.cost = cost #Search cost of this hypothesis: -(score + future score of the uncovered words)
 
     def get_foreign_phrase(self, src_sentence):
         """
         Takes src_sentence as a list of words.
-        Should return the foreign phrase the hypothesis covers as a space separated string.
+        Returns the foreign phrase the hypothesis covers as a space separated string.
         """
-        fp = src_sentence[self.fp_start]
-        for word in src_sentence[self.fp_start+1:self.fp_end]:
-            fp += " " + word
-        return fp
+        return " ".join(src_sentence[self.fp_start:self.fp_end + 1])
 
-    def compute_cost(self, ht, lm, pt):
+    def get_translation(self):
         """
-        Current cost: DONE
-        The product of translation, distortion and language model probalities for each phrase.
-
-        Future cost: TODO
-        Use Viterbi with language model translation
-
-        DISTORTION PROBABILITY:
-        What is this? Let's see...
-         log(α^(|ai−bi−1−1|))
-         α is a small constant.
-         ai is the start position of the foreign phrase generated by the ith english phrase
-            ai is self.fp_start
-         bi-1 is the end position of the foreign phrase generated by the i-1th english phrase
-            bi is self.prev_hyp.fp_end
+        Returns the english words of the hypothesis and all its predecessors in a list.
         """
-
-        translation_probability = pt[self.get_foreign_phrase()][self.english_phrase]
-        language_probability = lm.score(self.get_trigram)
-        distortion_probability = math.log(math.pow(DISTORTION_CONSTANT,math.abs(self.fp_start - self.prev_hyp.fp_end - 1)))
-
-        cur_prob = translation_probability+language_probability+distortion_probability
-
-        inZeroStreak = False
-        setOfIndexTuples = set()
-        curStartIndex
-        for i, char in enumerate(self.covering):
-            if char == '0' and not inZeroStreak:
-                inZeroStreak = True
-                curStartIndex = i
-            elif char == '1' and inZeroStreak:
-                inZeroStreak = False
-                setOfIndexTuples.add(curStartIndex,i)
-        if inZeroStreak: setOfIndexTuples.add(curStartIndex, len(self.covering)-1)
-
-        fut_prob = 0
-        
-        for futurePhrase in setOfIndexTuples:
-            fut_prob += ht[futurePhrase[0]][futurePhrase[1]]
-
-        total_prob = cur_prob + future_prob
-
-        return -total_prob
-
-    def get_trigram(self):
-        """
-        DONE
-        Returns the last (at most three) english words of the given hypothesis in a list.
-        """
-        trigram = []
-        cur_hyp = self
-        while cur_hyp.english_phrase and len(trigram) < 3:
-            trigram = [cur_hyp.english_phrase] + trigram
-            cur_hyp = cur_hyp.prev_hyp
-        trigram = trigram[-3:] if len(trigram) > 3 else trigram
-        return trigram
-
-
-    def __cmp__(self, other):
-        return cmp(self.cost, other.cost)
+        phrases = []
+        hyp = self
+        while hyp is not None:
+            phrases.append(hyp.english_phrase)
+            hyp = hyp.prev_hyp
+        return [word for phrase in reversed(phrases) for word in phrase]
 
 class Decoder:
     """
     Implements a decoder for statistical MT.
+
+    The score of a hypothesis is the sum, over its phrases, of the translation, language model and
+    distortion log-probabilities:
+        distortion: log(α^|ai − bi−1 − 1|)
+         α is a small constant (DISTORTION_CONSTANT).
+         ai is the start position of the foreign phrase generated by the ith english phrase (fp_start)
+         bi-1 is the end position of the foreign phrase generated by the i-1th english phrase (prev_hyp.fp_end)
+
+    Reordering is bounded by distortion_limit (on |ai − bi−1 − 1|) and reordering_window (see REORDERING_WINDOW).
+    An expansion that leaves a gap further back than distortion_limit from its end is refused, since the
+    gap could not be reached anymore.
     """
-    def __init__(self, phrase_table):
+    def __init__(self, phrase_table, language_model=None, cache=None, stack_size=MAX_STACK_LEN, beam=BEAM_THRESHOLD, max_phrase_len=MAX_PHRASE_LEN, table_limit=TABLE_LIMIT,
+                 distortion_limit=DISTORTION_LIMIT, reordering_window=REORDERING_WINDOW, model_version=None):
+        """
+        cache: optional TranslationCache remembering the translation options of every foreign span and the
+            translation of every sentence. Its entries are keyed on model_version, a string identifying the
+            phrase table and language model (e.g. TranslationCache.modelVersion of the files they were built
+            from), and on the decoder settings they depend on, so decoders with other models or settings can
+            share the cache, or keep it in a file, without reading each other's entries.
+        """
+        if cache is not None and model_version is None:
+            raise ValueError("A decoder cache needs the model_version of the phrase table and language model")
         self.phrase_table = phrase_table
-        self.language_model = LanguageModel()
-        self.heuristic_table = collections.defaultdict(lambda: {})
+        self.distortion_limit = distortion_limit
+        self.reordering_window = reordering_window
+        self.hypotheses_generated = 0 #Hypotheses created by derive_new_hyps so far
+        self.hypotheses_expanded = 0 #Hypotheses passed to derive_new_hyps so far
+        self.stack_size = stack_size #Histogram pruning limit of every stack
+        self.beam = beam #Threshold pruning limit: log-prob below the best hypothesis of the stack
+        self.max_phrase_len = max_phrase_len #Longest foreign phrase translated at once
+        self.table_limit = table_limit #Translations considered per foreign phrase
+        self.language_model = language_model or LanguageModel()
+        self.options = [] #options[i][l - 1] = translation options of the l foreign words starting at i, for the current sentence
+        self.future_table = [] #future_table[i][j] = estimated log-prob of translating the foreign words i to j - 1
+        self.future_scores = {} #coverage -> future_score of it, for the current sentence
+        self.cache = cache
+        self.options_version = modelVersion([], model=model_version, table_limit=table_limit) #Cache key prefix of span options
+        self.sentence_version = modelVersion([], model=model_version, table_limit=table_limit, max_phrase_len=max_phrase_len, stack_size=stack_size,
+            beam=beam, distortion_limit=distortion_limit, reordering_window=reordering_window, decoder="stack") #Cache key prefix of translations
+
+    def span_options(self, foreign_phrase):
+        """
+        Returns the translation options of foreign_phrase (a tuple of words): its table_limit best
+        (native phrase, translation log-prob, language model log-prob of the native phrase alone), best first.
+        An unknown single word is copied through untranslated; an unknown longer phrase has none.
+        """
+        cached = self.cache.getSpan((self.options_version,) + foreign_phrase) if self.cache else None
+        if cached is not None:
+            return cached
+        options = self.phrase_table.top_translations(foreign_phrase, self.table_limit, self.language_model)
+        if not options and len(foreign_phrase) == 1:
+            options = [(foreign_phrase, UNKNOWN_WORD_PROB, self.language_model.score(list(foreign_phrase)))]
+        if self.cache:
+            self.cache.putSpan((self.options_version,) + foreign_phrase, options)
+        return options
+
+    def collect_options(self, src_sentence):
+        """
+        Collects the translation options of every span of src_sentence up to max_phrase_len words into self.options
+        """
+        self.options = []
+        for i in xrange(len(src_sentence)):
+            self.options.append([self.span_options(tuple(src_sentence[i:j])) for j in xrange(i + 1, min(i + self.max_phrase_len, len(src_sentence)) + 1)])
+
+    def build_future_table(self, length):
+        """
+        Fills future_table[i][j] with the estimated log-prob of translating the foreign words i to j - 1:
+        the best option of the span (translation + language model log-prob of the phrase alone) or the
+        best way to split it in two spans, whichever is higher. Spans are visited shortest first, so
+        both halves are final when a span is split: O(length^3).
+        """
+        self.future_table = [[float('-inf')] * (length + 1) for i in xrange(length + 1)]
+        self.future_scores = {}
+        for span in xrange(1, length + 1):
+            for i in xrange(length - span + 1):
+                j = i + span
+                best = float('-inf')
+                if span <= len(self.options[i]) and self.options[i][span - 1]:
+                    native_phrase, translation_probability, lm_probability = self.options[i][span - 1][0]
+                    best = translation_probability + lm_probability
+                row = self.future_table[i]
+                for k in xrange(i + 1, j):
+                    split = row[k] + self.future_table[k][j]
+                    if split > best:
+                        best = split
+                row[j] = best
+
+    def future_score(self, coverage, length):
+        """
+        Estimated log-prob of translating the words not in coverage: the sum of future_table over its
+        maximal uncovered spans. Computed once per coverage pattern of the sentence.
+        """
+        score = self.future_scores.get(coverage)
+        if score is None:
+            score = 0.0
+            i = 0
+            while i < length:
+                if coverage >> i & 1:
+                    i += 1
+                    continue
+                j = i + 1
+                while j < length and not coverage >> j & 1:
+                    j += 1
+                score += self.future_table[i][j]
+                i = j
+            self.future_scores[coverage] = score
+        return score
 
     def derive_new_hyps(self, src_sentence, hyp):
         """
-        DONE
         returns all possible expansions of the given hypothesis.
         Loops through source sentence, starts expanding from each uncovered word.
-        for all totally uncovered phrases that are in the dict,
-            creates a new hypothesis with an updated covering and new phrase.
+        for all totally uncovered phrases starting there, walks the options collected for the sentence
+            and creates a new hypothesis with an updated coverage and new phrase for each.
         returns the list of all the new hypotheses.
         """
         new_hyps = []
-        for i in xrange(src_sentence):
-            if hyp.covering[i] == '1':
+        length = len(src_sentence)
+        limit = self.distortion_limit
+        first_gap = first_uncovered(hyp.coverage)
+        last_end = length if self.reordering_window is None else min(length, first_gap + self.reordering_window)
+        for i in xrange(last_end):
+            if hyp.coverage >> i & 1:
                 continue
-            cur_phrase = []
-            j = 0
-            while i+j < len(src_sentence):
-                phrase.append(src_sentence[i + j])
-                if phrase in self.phrase_table and hyp.covering[i + j] == '0':
-                    for native_phrase, prob in self.phrase_table[phrase]:
-                        new_hyp = Hypothesis(native_phrase, hyp.covering[:i] + '1' * (j + 1 - i) + covering[j+1:], i, i+j, hyp, self.heuristic_table, self.language_model, self.phrase_table)
-                        new_hyps.append(new_hyp)
-                    j += 1
-                else:
+            jump = abs(i - hyp.fp_end - 1)
+            if limit is not None and jump > limit:
+                continue
+            distortion = LOG_DISTORTION * jump
+            for j, options in enumerate(self.options[i], i):
+                if j >= last_end or hyp.coverage >> j & 1:
                     break
+                coverage = hyp.coverage | (((1 << (j + 1 - i)) - 1) << i)
+                if limit is not None and first_gap < i and j + 1 - first_gap > limit:
+                    break #the first gap would be out of reach, and more so after a longer phrase
+                if not options:
+                    continue
+                future = self.future_score(coverage, length)
+                for native_phrase, translation_probability, lm_probability in options:
+                    lm_score, lm_state = self.language_model.score_phrase(hyp.lm_state, native_phrase)
+                    score = hyp.score + translation_probability + lm_score + distortion
+                    new_hyps.append(Hypothesis(native_phrase, coverage, i, j, hyp, lm_state, score, -(score + future)))
+        self.hypotheses_expanded += 1
+        self.hypotheses_generated += len(new_hyps)
         return new_hyps
 
     def beam_search_stack_decode(self, src_sentence):
         """
-        Assumes src_sentence is a list of tokens.
+        Assumes src_sentence is a list of tokens, returns the best hypothesis covering all of it.
         hypStacks is a list of hypothesis stacks.
         the i'th stack in hypStacks consists of hypotheses that cover i words of the foreign sentence
         """
-        for i in xrange(len(src_sentence)):
-            for j in xrange(i+1, len(src_sentence)):
-                foreign_phrase = src_sentence[i:j]
-                best_phrase = ""
-                highest_prob = float('-inf')
-                for native_phrase, translation_probability in self.phrase_table[foreign_phrase]:
-                    prob = translation_probability + self.language_model.score(native_phrase.split())
-                    if prob > highest_prob:
-                        highest_prob = prob
-                        best_phrase = native_phrase
-                self.heuristic_table[i][j] = (best_phrase, highest_prob)
-
-
-
-        hypStacks = [ HypoStack() for i in len(src_sentence)]
-        """
-        What will the cost of NULL Hypothesis be? Right now I don't know what it calculates but I'm enqueueing it with FLT_MAX
-        """
-        hypStacks[0].add(Hypothesis([], '0' * len(src_sentence), 0, 0, None, self.heuristic_table, self.language_model, self.phrase_table), float('inf'))
-
-        for hypStack in hypStacks:
-            while len(hypStack) > 0:
-                hyp = hypStack.pop()
-                new_hyps = self.derive_new_hyps(hyp)
-                for new_hyp in new_hyps:
-                    nf_new_hyp = new_hyp.covering.count('1')
-                    """
-                    DONE
-                    For recombination, whenever you add a new hypothesis, look at the other hypotheses in the same stack and do this:
-                        – same number of foreign words translated
-                        – same last three English words in output
-                        – same last foreign word translated
-                    """
-                    new_hyp_trigram = new_hyp.get_trigram()
-                    new_hyp_last_word = src_sentence[new_hyp.fp_end]
-                    add_new_hyp = True
-                    for other_hyp  in hypStacks[nf_new_hyp]:
-                        if other_hyp.get_trigram() == new_hyp_trigram and src_sentence[other_hyp.fp_end] == new_hyp_last_word:
-                            if other_hyp.cost < new_hyp.cost:
-                                add_new_hyp = False
-                                break
-                            else:
-                                hypStacks[nf_new_hyp].remove(other_hyp)
-                    if not add_new_hyp: continue
-                    hypStacks[nf_new_hyp].add(new_hyp, new_hyp.cost)
-                    if len(hypStacks[nf_new_hyp]) > MAX_STACK_LEN:
-                        hypStacks[nf_new_hyp].remove_worst()
-        return hypStacks[-1].pop()
+        self.collect_options(src_sentence)
+        self.build_future_table(len(src_sentence))
+        hypStacks = [HypoStack(self.stack_size, self.beam) for i in xrange(len(src_sentence) + 1)]
+        empty = Hypothesis((), 0, -1, -1, None, LanguageModel.START, 0.0, -self.future_score(0, len(src_sentence)))
+        hypStacks[0].push(empty)
+
+        for nf, hypStack in enumerate(hypStacks[:-1]):
+            for hyp in hypStack.hypotheses():
+                for new_hyp in self.derive_new_hyps(src_sentence, hyp):
+                    hypStacks[nf + new_hyp.fp_end - new_hyp.fp_start + 1].push(new_hyp)
+        return hypStacks[-1].hypotheses()[0]
+
+    def decode(self, src_sentence):
+        """
+        Returns the best translation of src_sentence (a list of words) as a list of words
+        """
+        if not src_sentence:
+            return []
+        if self.cache:
+            translation = self.cache.get([self.sentence_version] + list(src_sentence))
+            if translation is not None:
+                return list(translation)
+        translation = self.beam_search_stack_decode(src_sentence).get_translation()
+        if self.cache:
+            self.cache.put([self.sentence_version] + list(src_sentence), translation)
+        return list(translation)
+
+    def evaluate(self, sentences, references):
+        """
+        Decodes sentences (lists of words) and scores them against references (strings) with bleu_for_one.
+        Returns the translations and a dictionary of the number of sentences, hypotheses generated and
+        expanded, decoding time and mean BLEU-1 and BLEU-2.
+        """
+        generated, expanded = self.hypotheses_generated, self.hypotheses_expanded
+        start = time.time()
+        translations = [" ".join(self.decode(src_sentence)) for src_sentence in sentences]
+        seconds = time.time() - start
+        scores = [bleu_for_one(reference, translation) for reference, translation in it.izip(references, translations)]
+        scores = [score for score in scores if score[0] is not None]
+        return translations, {
+            "sentences": len(translations),
+            "generated": self.hypotheses_generated - generated,
+            "expanded": self.hypotheses_expanded - expanded,
+            "seconds": seconds,
+            "bleu1": sum(score[0] for score in scores) / len(scores) if scores else 0.0,
+            "bleu2": sum(score[1] for score in scores) / len(scores) if scores else 0.0,
+        }
+
+def first_uncovered(coverage):
+    """
+    Returns the index of the first foreign word not in coverage
+    """
+    return ((coverage + 1) & ~coverage).bit_length() - 1
+
+######FOR TESTING PURPOSES ONLY########
+def main(argv):
+    """
+    decoder.py -f foreign -n native -s sentences [-g lm.bin] [-m stack size] [-t beam threshold] [-p max phrase length] [-k table limit]
+               [-d distortion limits] [-w reordering window] [-r references]
+    builds a phrase table from the foreign and native bitext and decodes the lines of sentences.
+    -d takes a comma separated list of distortion limits (-1 for none). With -r, the hypotheses explored,
+    decoding time and BLEU are reported for each of them, otherwise the translations are printed.
+    """
+    import sys
+    import getopt
+    from BidirectionalModelOne import BidirectionalModelOne
+    opts = dict(getopt.getopt(argv, "f:n:s:g:m:t:p:k:d:w:r:")[0])
+    foreign_file, native_file = opts["-f"], opts["-n"]
+    language_model = LanguageModel(binary_file=opts["-g"]) if "-g" in opts else LanguageModel()
+    phrase_table = PhraseTable(foreign_file, native_file, models=BidirectionalModelOne(foreign_file, native_file))
+    with open(opts["-s"]) as f:
+        sentences = [phrase_table.fore_to_nat_model.processSentence(line) for line in f]
+    references = open(opts["-r"]).readlines() if "-r" in opts else [""] * len(sentences)
+    limits = [int(limit) for limit in opts.get("-d", str(DISTORTION_LIMIT)).split(",")]
+    for limit in limits:
+        decoder = Decoder(phrase_table, language_model, stack_size=int(opts.get("-m", MAX_STACK_LEN)), beam=float(opts.get("-t", BEAM_THRESHOLD)),
+            max_phrase_len=int(opts.get("-p", MAX_PHRASE_LEN)), table_limit=int(opts.get("-k", TABLE_LIMIT)),
+            distortion_limit=limit if limit >= 0 else None, reordering_window=int(opts["-w"]) if "-w" in opts else REORDERING_WINDOW)
+        translations, report = decoder.evaluate(sentences, references)
+        if "-r" in opts:
+            print "distortion limit %s: %d sentences, %d hypotheses generated, %d expanded, %.2fs, BLEU-1 %.4f, BLEU-2 %.4f" % (
+                limit if limit >= 0 else "none", report["sentences"], report["generated"], report["expanded"], report["seconds"], report["bleu1"], report["bleu2"])
+        else:
+            print "\n".join(translations)
 
 if __name__ == '__main__':
-    hp = HypoStack()
-    hp.add('apples', 1)
-    hp.add('donuts', 4)
-    hp.add('bananas', 2)
-    hp.add('carrots', 3)
-    hp.remove('donuts')
-    hp.add('ZZZ', 100)
-    hp.add('AAA', 0)
-    while len(hp) > 0:
-        print hp.pop()
\ No newline at end of file
+    import sys
+    main(sys.argv[1:])